@@ -0,0 +1,164 @@
+__author__ = 'Jody Shumaker'
+
+import numpy as np
+import bitboard
+
+# Simulates many boards at once. A batch is an array of shape (boards, CELLS) holding the index of the item type at
+# each cell, cells indexed as in bitboard, UNKNOWN for unknown cells. Results match the bitboard functions exactly.
+UNKNOWN = 255
+
+_LINES = np.array(bitboard.LINES)
+# Cells of each line as a 0/1 matrix, multiplying by the lines that match marks every cell cleared.
+_LINE_CELLS = np.zeros((len(bitboard.LINES), bitboard.CELLS), dtype=np.int32)
+for _index, _line in enumerate(bitboard.LINES):
+    _LINE_CELLS[_index, list(_line)] = 1
+_SWAP_CELLS = np.array(bitboard.SWAPS)
+
+
+def encode(boards, types):
+    """
+    :param boards: List of compact boards, see bitboard.
+    :param types: Number of item types.
+    :return: Batch of the boards.
+    """
+    batch = np.full((len(boards), bitboard.CELLS), UNKNOWN, dtype=np.uint8)
+    for row, board in enumerate(boards):
+        for index in range(types):
+            mask = board[index]
+            for cell_index in range(bitboard.CELLS):
+                if mask >> cell_index & 1:
+                    batch[row, cell_index] = index
+    return batch
+
+
+def decode(batch, types):
+    """
+    :return: List of compact boards in a batch.
+    """
+    boards = []
+    weights = 1 << np.arange(bitboard.CELLS, dtype=np.int64)
+    for index in range(types):
+        boards.append(((batch == index) * weights).sum(axis=1))
+    return [tuple(int(masks[row]) for masks in boards) for row in range(len(batch))]
+
+
+def matches(batch):
+    """
+    :return: bool array of shape (boards, CELLS), True for cells in a line of 3 or more of the same item type.
+    """
+    values = batch[:, _LINES]
+    lines = (values[:, :, 0] == values[:, :, 1]) & (values[:, :, 1] == values[:, :, 2]) & \
+        (values[:, :, 0] != UNKNOWN)
+    return lines.astype(np.int32).dot(_LINE_CELLS) > 0
+
+
+def removed(batch, cleared, types):
+    """
+    :return: int array of shape (boards, types), the number of each item type cleared.
+    """
+    counts = np.zeros((len(batch), types), dtype=np.int64)
+    for index in range(types):
+        counts[:, index] = (cleared & (batch == index)).sum(axis=1)
+    return counts
+
+
+def drop(batch, cleared):
+    """
+    Remove cleared cells and drop the items above them down, see bitboard.drop.
+    """
+    columns = batch.reshape(-1, bitboard.WIDTH, bitboard.HEIGHT)
+    keep = ~cleared.reshape(columns.shape)
+    # A stable sort puts cleared cells first, the top of the column, and keeps the order of the rest.
+    order = np.argsort(keep, axis=2, kind='stable')
+    dropped = np.take_along_axis(columns, order, axis=2)
+    dropped[~np.take_along_axis(keep, order, axis=2)] = UNKNOWN
+    return dropped.reshape(batch.shape)
+
+
+def fill_random(batch, types, rng, cells=None):
+    """
+    Replace unknown cells with random item types.
+    :param rng: numpy.random.Generator
+    :param cells: bool array of the cells to fill, defaults to every unknown cell.
+    """
+    if cells is None:
+        cells = batch == UNKNOWN
+    else:
+        cells = np.broadcast_to(cells, batch.shape)
+    batch = batch.copy()
+    batch[cells] = rng.integers(0, types, size=int(cells.sum()), dtype=np.uint8)
+    return batch
+
+
+def cascade(batch, score, types, fillrandom=False, rng=None):
+    """
+    Clear matches, dropping items and clearing again until nothing more clears, on every board.
+    :param score: Function taking the removed counts of a clear on each board, returning an array of points, see
+    Grid.score_batch.
+    :param fillrandom: Replace emptied cells with random items from rng instead of leaving them unknown.
+    :return: (points, batch) tuple, points being a float array.
+    """
+    batch = batch.copy()
+    points = np.zeros(len(batch))
+    active = np.arange(len(batch))
+    while len(active) > 0:
+        boards = batch[active]
+        cleared = matches(boards)
+        clearing = cleared.any(axis=1)
+        active = active[clearing]
+        boards = boards[clearing]
+        cleared = cleared[clearing]
+        if len(active) == 0:
+            break
+        points[active] += score(removed(boards, cleared, types))
+        boards = drop(boards, cleared)
+        if fillrandom:
+            boards = fill_random(boards, types, rng)
+        batch[active] = boards
+    return points, batch
+
+
+def expand(batch):
+    """
+    Swap every pair of cells on every board.
+    :return: (children, valid) tuple. children has a board per board and swap, in the order of bitboard.SWAPS, valid
+    is False for swaps of 2 equal items that aren't moves.
+    """
+    count = len(_SWAP_CELLS)
+    children = np.repeat(batch, count, axis=0)
+    rows = np.arange(len(children))
+    cells1 = np.tile(_SWAP_CELLS[:, 0], len(batch))
+    cells2 = np.tile(_SWAP_CELLS[:, 1], len(batch))
+    items1 = children[rows, cells1]
+    items2 = children[rows, cells2]
+    children[rows, cells1] = items2
+    children[rows, cells2] = items1
+    return children, items1 != items2
+
+
+def search(batch, depth, score, types, factor, chunk=65536):
+    """
+    Find the best sequence of moves on every board, simulating every move of a depth at once.
+    :param factor: How much each move deeper counts, see grid.depth_factor.
+    :param chunk: Most boards simulated at once, bounds memory for deep searches.
+    :return: (totals, swaps) tuple of arrays, the total points of the best sequence of moves and the index in
+    bitboard.SWAPS of its first move, -1 if there is no possible move.
+    """
+    count = len(_SWAP_CELLS)
+    totals = np.zeros(len(batch))
+    swaps = np.full(len(batch), -1)
+    step = max(1, chunk // count)
+    for start in range(0, len(batch), step):
+        parents = batch[start:start + step]
+        children, valid = expand(parents)
+        points, after = cascade(children[valid], score, types)
+        if depth > 1:
+            points = points + search(after, depth - 1, score, types, factor, chunk)[0] * factor
+        move_totals = np.full(len(children), -np.inf)
+        move_totals[valid] = points
+        move_totals = move_totals.reshape(len(parents), count)
+        best = move_totals.argmax(axis=1)
+        found = valid.reshape(len(parents), count).any(axis=1)
+        totals[start:start + step] = np.where(found, move_totals[np.arange(len(parents)), best], 0.0)
+        swaps[start:start + step] = np.where(found, best, -1)
+    return totals, swaps
@@ -0,0 +1,462 @@
+__author__ = 'Jody Shumaker'
+
+import argparse
+import importlib
+import json
+import os.path
+import random
+import numpy as np
+import element
+from grid import *
+from tarot import TarotCards, CardOnBoard, card_positions, flips_offsetx, flips_offsety, digit_width
+from utility.logconfig import *
+from utility.capture import Capture, ReplayBackend
+from utility.stats import mean, percentile
+from utility.templates import draw_template
+from PIL import Image
+import logging
+
+# Benchmarks how long screen recognition takes and how often it's right, over frames of the game window with known
+# contents. Frames come from a corpus of labeled screenshots where one is given, otherwise they're synthesized from the
+# template images. Runs anywhere, nothing is read from the screen or clicked.
+
+# Size of synthesized frames, large enough for every tarot level.
+FRAME_SIZE = (1040, 660)
+
+# Games imported so far, see load_game.
+_games = {}
+
+
+def load_game(name):
+    """
+    Import gemology or dragonsoul. Each replaces Grid.GridItemTypes when imported, so keep the item types it set.
+    :return: (module, item types) tuple.
+    """
+    if name not in _games:
+        module = importlib.import_module(name)
+        _games[name] = (module, list(Grid.GridItemTypes))
+    return _games[name]
+
+
+def background(rng):
+    """
+    :param rng: numpy.random.Generator
+    :return: Frame of dark random pixels to draw templates on.
+    """
+    pixels = rng.integers(0, 96, size=(FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8)
+    return Image.fromarray(pixels, 'RGB')
+
+
+def add_noise(frame, noise, rng):
+    """
+    :param noise: Standard deviation of the noise added to each color of each pixel.
+    """
+    if noise <= 0:
+        return frame
+    pixels = np.asarray(frame, dtype=np.float64)
+    pixels = pixels + rng.normal(0.0, noise, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+
+
+def frame_center():
+    return int(FRAME_SIZE[0] / 2), int(FRAME_SIZE[1] / 2)
+
+
+class Recognizer:
+    """
+    Reads one thing from a frame of the game window, such as the grid or the energy left.
+    """
+    name = None
+
+    def synthesize(self, rand, rng):
+        """
+        Draw a frame with random contents.
+        :param rand: random.Random for the contents.
+        :param rng: numpy.random.Generator for the background.
+        :return: (frame, label, params) tuple. label is what read should return, params is a dict of anything else
+        read needs to know, such as the tarot level.
+        """
+        raise Exception("synthesize must be overridden.")
+
+    def read(self, frame, params):
+        """
+        :return: (value, seconds) tuple, the value read from the frame, None if nothing was recognized, and the seconds
+        the recognition itself took.
+        """
+        raise Exception("read must be overridden.")
+
+
+class GridUpdate(Recognizer):
+    """
+    Grid.update detecting every item of a gemology or dragonsoul grid.
+    """
+
+    def __init__(self, game):
+        self.name = game + '.update'
+        self.module, self.itemtypes = load_game(game)
+        self.board = self.module.Board(grid=[[None]*5]*5, processes=1)
+
+    def setup(self, frame):
+        Grid.GridItemTypes = self.itemtypes
+        self.board.capture = Capture(backend=ReplayBackend([frame]))
+        self.board.game_window = (0, 0, frame.size[0], frame.size[1])
+        self.board.game_center = (int(frame.size[0] / 2), int(frame.size[1] / 2))
+
+    def synthesize(self, rand, rng):
+        self.setup(background(rng))
+        self.board.set_grid_pos()
+        # The grid is found within 20 pixels of where it's expected, see Grid.locate.
+        xoffset = self.board.xoffset + rand.randint(-8, 8)
+        yoffset = self.board.yoffset + rand.randint(-8, 8)
+        grid = []
+        for x in range(5):
+            column = []
+            for y in range(5):
+                # A grid with 3 in a line is still clearing, update rejects it.
+                choices = [itemtype for itemtype in self.itemtypes
+                           if not (x >= 2 and grid[x - 1][y] is grid[x - 2][y] is itemtype) and
+                           not (y >= 2 and column[y - 1] is column[y - 2] is itemtype)]
+                column.append(rand.choice(choices))
+            grid.append(column)
+        frame = SyntheticGrid(grid, xoffset, yoffset, FRAME_SIZE, background(rng)).render()
+        return frame, [[itemtype.name for itemtype in column] for column in grid], {}
+
+    def read(self, frame, params):
+        self.setup(frame)
+        self.board.set_grid_pos()
+        # Finding the grid is done once per game, only time the update.
+        if not self.board.locate(self.board.capture.grab()):
+            return None, 0.0
+        self.board.grid = None
+        starttime = time.time()
+        updated = self.board.update(incremental=False)
+        seconds = time.time() - starttime
+        if not updated:
+            return None, seconds
+        return [[itemtype.name for itemtype in column] for column in self.board.grid], seconds
+
+
+class ParseEnergy(GridUpdate):
+    """
+    Grid.parse_energy reading the energy left in gemology or dragonsoul.
+    """
+
+    def __init__(self, game):
+        GridUpdate.__init__(self, game)
+        self.name = game + '.parse_energy'
+
+    def synthesize(self, rand, rng):
+        frame = background(rng)
+        self.setup(frame)
+        self.board.set_energy_pos()
+        length = rand.randint(1, 4)
+        energy = rand.randint(0 if length == 1 else 10 ** (length - 1), 10 ** length - 1)
+        # Offset of the first digit for 4, 3, 2 and 1 digits, see Grid.parse_energy.
+        x = self.board.energy_pos[0] + [-43, -29, -15, 0][4 - length] + rand.randint(-3, 3)
+        y = self.board.energy_pos[1] + rand.randint(-1, 1)
+        digits = dict(self.board.digits)
+        for digit in str(energy):
+            draw_template(frame, digits[digit], x, y)
+            x += 28 + rand.randint(-1, 1)
+        return frame, energy, {}
+
+    def read(self, frame, params):
+        self.setup(frame)
+        starttime = time.time()
+        try:
+            energy = self.board.parse_energy()
+        except SystemExit:
+            # Failed to find the first digit.
+            energy = None
+        return energy, time.time() - starttime
+
+
+class DetectCard(Recognizer):
+    """
+    TarotCards.detect_card naming a flipped card.
+    """
+    name = 'tarot.detect_card'
+
+    def __init__(self, tarot):
+        self.tarot = tarot
+
+    def setup(self, frame, level):
+        self.tarot.capture = Capture(backend=ReplayBackend([frame]))
+        self.tarot.gamepos = (0, 0)
+        self.tarot.gamesize = frame.size
+        self.tarot.gamecenter = (int(frame.size[0] / 2), int(frame.size[1] / 2))
+        self.tarot.level = level
+
+    def synthesize(self, rand, rng):
+        frame = background(rng)
+        level = rand.randrange(len(card_positions))
+        cardnum = rand.randrange(len(card_positions[level]))
+        name, card = rand.choice(self.tarot.tarot_cards)
+        center = frame_center()
+        draw_template(frame, card, center[0] + card_positions[level][cardnum][0] + rand.randint(-1, 1),
+                      center[1] + card_positions[level][cardnum][1] + rand.randint(-1, 1))
+        return frame, name, {'level': level, 'cardnum': cardnum}
+
+    def read(self, frame, params):
+        self.setup(frame, params['level'])
+        self.tarot.cards_on_board = [CardOnBoard(i) for i in range(len(card_positions[params['level']]))]
+        starttime = time.time()
+        self.tarot.detect_card(params['cardnum'], dumb=True)
+        seconds = time.time() - starttime
+        return self.tarot.cards_on_board[params['cardnum']].name, seconds
+
+
+class ParseFlips(DetectCard):
+    """
+    TarotCards.parse_flips reading the flips left.
+    """
+    name = 'tarot.parse_flips'
+
+    def synthesize(self, rand, rng):
+        frame = background(rng)
+        length = rand.randint(1, 3)
+        flips = rand.randint(0 if length == 1 else 10 ** (length - 1), 10 ** length - 1)
+        digits = dict(self.tarot.digits)
+        x = flips_offsetx + rand.randint(-1, 1)
+        y = flips_offsety + rand.randint(-1, 1)
+        # The digit after the last is blank, matching the end image.
+        for position, digit in enumerate(list(str(flips)) + ['end']):
+            if position < 3:
+                draw_template(frame, digits[digit], x + position * digit_width, y)
+        return frame, flips, {}
+
+    def read(self, frame, params):
+        self.setup(frame, 0)
+        self.tarot.flips_left = None
+        starttime = time.time()
+        self.tarot.parse_flips()
+        return self.tarot.flips_left, time.time() - starttime
+
+
+class ElementDigits(Recognizer):
+    """
+    element.read_digits reading the levels gained by an element upgrade.
+    """
+    name = 'element.digits'
+
+    def __init__(self):
+        self.digits = element.load_digits()
+
+    def synthesize(self, rand, rng):
+        frame = background(rng)
+        center = frame_center()
+        label = []
+        for offsetx, offsety in element.digit_offsets:
+            name, digit = rand.choice(self.digits)
+            draw_template(frame, digit, center[0] + offsetx + rand.randint(-2, 2),
+                          center[1] + offsety + rand.randint(-2, 2))
+            label.append(int(name))
+        return frame, label, {}
+
+    def read(self, frame, params):
+        center = (int(frame.size[0] / 2), int(frame.size[1] / 2))
+        starttime = time.time()
+        values = element.read_digits(frame, self.digits, center)
+        return values, time.time() - starttime
+
+
+def create_recognizers(names=None):
+    """
+    :param names: Names of the recognizers to create, None for all of them.
+    :return: List of Recognizer
+    """
+    tarot = TarotCards()
+    recognizers = [GridUpdate('gemology'), ParseEnergy('gemology'), GridUpdate('dragonsoul'),
+                   ParseEnergy('dragonsoul'), DetectCard(tarot), ParseFlips(tarot), ElementDigits()]
+    if names:
+        unknown = set(names) - set(recognizer.name for recognizer in recognizers)
+        if unknown:
+            raise ValueError("Unknown recognizers: {0}".format(", ".join(sorted(unknown))))
+        recognizers = [recognizer for recognizer in recognizers if recognizer.name in names]
+    return recognizers
+
+
+def load_corpus(directory):
+    """
+    Load labeled frames saved by save_corpus, or screenshots of the game labeled by hand in the same format.
+    :return: dict of recognizer name to a list of (frame, label, params) tuples.
+    """
+    with open(os.path.join(directory, 'labels.json')) as f:
+        entries = json.load(f)
+    corpus = {}
+    for entry in entries:
+        frame = Image.open(os.path.join(directory, entry['file']))
+        frame.load()
+        corpus.setdefault(entry['recognizer'], []).append((frame.convert('RGB'), entry['label'],
+                                                           entry.get('params', {})))
+    return corpus
+
+
+def save_corpus(directory, corpus):
+    """
+    Save labeled frames as PNG files and a labels.json listing the recognizer, file, label and params of each.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    entries = []
+    for name in sorted(corpus):
+        for index, (frame, label, params) in enumerate(corpus[name]):
+            filename = "{0}_{1:04}.png".format(name.replace('.', '_'), index)
+            frame.save(os.path.join(directory, filename), compress_level=1)
+            entries.append({'recognizer': name, 'file': filename, 'label': label, 'params': params})
+    with open(os.path.join(directory, 'labels.json'), 'w') as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    logging.info("Saved {0} frames to {1}".format(len(entries), directory))
+
+
+def run(recognizers, corpus, frames, seed, noise):
+    """
+    Time each recognizer over its frames from corpus, synthesizing frames for recognizers without any.
+    :param frames: Frames to synthesize per recognizer.
+    :param noise: Standard deviation of noise added to synthesized frames, see add_noise.
+    :return: (results, corpus) tuple. results is a dict of recognizer name to its accuracy and percentiles of the
+    seconds per call, corpus includes the synthesized frames.
+    """
+    corpus = dict(corpus)
+    results = {}
+    for recognizer in recognizers:
+        cases = corpus.get(recognizer.name)
+        if not cases:
+            rand = random.Random(seed)
+            rng = np.random.default_rng(seed)
+            cases = []
+            for i in range(frames):
+                frame, label, params = recognizer.synthesize(rand, rng)
+                cases.append((add_noise(frame, noise, rng), label, params))
+            corpus[recognizer.name] = cases
+        logging.info("Benchmarking {0} over {1} frames...".format(recognizer.name, len(cases)))
+        # Warm up, the first call converts templates.
+        recognizer.read(cases[0][0], cases[0][2])
+        times = []
+        correct = 0
+        for index, (frame, label, params) in enumerate(cases):
+            value, seconds = recognizer.read(frame, params)
+            times.append(seconds)
+            if value == label:
+                correct += 1
+            else:
+                logging.log(VERBOSE, "{0} frame {1}: read {2}, expected {3}".format(recognizer.name, index, value,
+                                                                                  label))
+        results[recognizer.name] = {
+            'frames': len(cases),
+            'correct': correct,
+            'accuracy': float(correct) / len(cases),
+            'mean': mean(times),
+            'p50': percentile(times, 50),
+            'p95': percentile(times, 95),
+            'p99': percentile(times, 99),
+            'max': max(times),
+        }
+    return results, corpus
+
+
+def compare(results, baseline, latency_tolerance, accuracy_tolerance):
+    """
+    :param baseline: Results of an earlier run, see run.
+    :param latency_tolerance: Fraction a percentile can grow over the baseline before it's a regression.
+    :param accuracy_tolerance: Amount accuracy can drop below the baseline before it's a regression.
+    :return: List of descriptions of each regression.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        result = results[name]
+        base = baseline[name]
+        if result['accuracy'] < base['accuracy'] - accuracy_tolerance:
+            regressions.append("{0} accuracy {1:.1%}, baseline {2:.1%}".format(name, result['accuracy'],
+                                                                              base['accuracy']))
+        for key in ['p50', 'p95']:
+            if result[key] > base[key] * (1.0 + latency_tolerance):
+                regressions.append("{0} {1} {2:.2f}ms, baseline {3:.2f}ms".format(name, key, result[key] * 1000,
+                                                                                  base[key] * 1000))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the speed and accuracy of screen recognition.')
+    parser.add_argument('--frames', type=int, default=50, help="""
+    Frames to synthesize for each recognizer without frames in --corpus.
+    """)
+    parser.add_argument('--seed', type=int, default=0, help="""
+    Seed of the synthesized frames, the same seed always draws the same frames.
+    """)
+    parser.add_argument('--noise', type=float, default=2.0, help="""
+    Standard deviation of the noise added to each color of synthesized frames.
+    """)
+    parser.add_argument('--only', action='append', default=[], metavar='NAME', help="""
+    Only benchmark this recognizer, can be given more than once. Recognizers: gemology.update,
+    gemology.parse_energy, dragonsoul.update, dragonsoul.parse_energy, tarot.detect_card, tarot.parse_flips,
+    element.digits.
+    """)
+    parser.add_argument('--corpus', metavar='DIR', help="""
+    Directory of labeled frames, with a labels.json as written by --save-corpus. Recognizers without frames in it use
+    synthesized frames.
+    """)
+    parser.add_argument('--save-corpus', metavar='DIR', help="""
+    Save the frames benchmarked and their labels to DIR, to reuse with --corpus.
+    """)
+    parser.add_argument('--baseline', metavar='FILE', help="""
+    Compare against results saved by --save-baseline, exiting with status 1 if any recognizer regressed.
+    """)
+    parser.add_argument('--save-baseline', metavar='FILE', help="""
+    Save the results to FILE to compare later runs against.
+    """)
+    parser.add_argument('--latency-tolerance', type=float, default=0.5, help="""
+    Fraction the p50 or p95 seconds per call can exceed the baseline by before it's a regression.
+    """)
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.0, help="""
+    Amount accuracy can drop below the baseline by before it's a regression.
+    """)
+    parser.add_argument('--debug', action='store_true', help="""
+    Enable debug mode, extra details will be added to log file.
+    """)
+    args = parser.parse_args()
+
+    loglevel = VERBOSE
+    if args.debug:
+        loglevel = logging.DEBUG
+    logconfig('benchmark_recognition', loglevel)
+
+    try:
+        recognizers = create_recognizers(args.only)
+    except ValueError as e:
+        parser.error(str(e))
+
+    corpus = load_corpus(args.corpus) if args.corpus else {}
+    results, corpus = run(recognizers, corpus, args.frames, args.seed, args.noise)
+    if args.save_corpus:
+        save_corpus(args.save_corpus, corpus)
+
+    logging.info("{0:<24} | {1:>8} | {2:>8} | {3:>8} | {4:>8}".format('Recognizer', 'Accuracy', 'p50 ms', 'p95 ms',
+                                                                     'p99 ms'))
+    for name in sorted(results):
+        result = results[name]
+        logging.info("{0:<24} | {1:>8.1%} | {2:>8.2f} | {3:>8.2f} | {4:>8.2f}".format(
+            name, result['accuracy'], result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000))
+
+    summary = {'recognizers': results, 'seed': args.seed, 'noise': args.noise}
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        logging.info("Saved baseline to {0}".format(args.save_baseline))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['recognizers'], args.latency_tolerance, args.accuracy_tolerance)
+        for regression in regressions:
+            logging.error("Regression: {0}".format(regression))
+        if not regressions:
+            logging.info("No regressions against {0}".format(args.baseline))
+        summary['regressions'] = regressions
+
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    sys.exit(1 if regressions else 0)
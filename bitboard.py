@@ -0,0 +1,253 @@
+__author__ = 'Jody Shumaker'
+
+import random
+
+# Compact representation of the 5x5 grid used when simulating moves.
+# A board is a tuple holding a 25 bit mask per item type, bit x * 5 + y is set when that item type is at x, y. The
+# position of the item type in Grid.GridItemTypes is its index in the tuple. Cells not set in any mask are unknown,
+# which is also what cells left empty by a drop become.
+WIDTH = 5
+HEIGHT = 5
+CELLS = WIDTH * HEIGHT
+FULL = (1 << CELLS) - 1
+
+
+def cell(x, y):
+    return x * HEIGHT + y
+
+
+def position(cell_index):
+    """
+    :return: x, y tuple of a cell.
+    """
+    return divmod(cell_index, HEIGHT)
+
+
+# Cells of every horizontal and vertical line of 3.
+LINES = [(cell(x, y), cell(x + 1, y), cell(x + 2, y)) for x in range(WIDTH - 2) for y in range(HEIGHT)] + \
+        [(cell(x, y), cell(x, y + 1), cell(x, y + 2)) for x in range(WIDTH) for y in range(HEIGHT - 2)]
+
+# Mask of each line.
+LINE_MASKS = [1 << cell1 | 1 << cell2 | 1 << cell3 for cell1, cell2, cell3 in LINES]
+# Cells a horizontal or vertical line can start at. Horizontal neighbours are HEIGHT bits apart and vertical ones 1 bit
+# apart, so shifting a mask lines up each cell with its neighbours.
+HORIZONTAL_STARTS = 0
+VERTICAL_STARTS = 0
+for _line in LINES[:(WIDTH - 2) * HEIGHT]:
+    HORIZONTAL_STARTS |= 1 << _line[0]
+for _line in LINES[(WIDTH - 2) * HEIGHT:]:
+    VERTICAL_STARTS |= 1 << _line[0]
+
+# For each cell, the masks of the other 2 cells of every line through it.
+LINE_RESTS = [[mask & ~(1 << cell_index) for mask in LINE_MASKS if mask >> cell_index & 1] for cell_index in range(CELLS)]
+
+# Pairs of cells that can be swapped.
+SWAPS = []
+for _x, _y in [(x, y) for x in range(WIDTH - 1) for y in range(HEIGHT - 1)]:
+    # Swap right
+    SWAPS.append((cell(_x, _y), cell(_x + 1, _y)))
+    # Swap down
+    SWAPS.append((cell(_x, _y), cell(_x, _y + 1)))
+# Bottom row moves.
+for _x in range(WIDTH - 1):
+    SWAPS.append((cell(_x, HEIGHT - 1), cell(_x + 1, HEIGHT - 1)))
+# Right column moves.
+for _y in range(HEIGHT - 1):
+    SWAPS.append((cell(WIDTH - 1, _y), cell(WIDTH - 1, _y + 1)))
+
+
+def encode(grid, itemtypes):
+    """
+    :param grid: List of columns of item types, as Grid.grid. Items not in itemtypes are stored as unknown.
+    :param itemtypes: List of item types that can be cleared.
+    :return: board
+    """
+    indexes = {}
+    for index, itemtype in enumerate(itemtypes):
+        indexes[itemtype] = index
+    masks = [0] * len(itemtypes)
+    for x in range(WIDTH):
+        for y in range(HEIGHT):
+            item = grid[x][y]
+            if item is not None and item in indexes:
+                masks[indexes[item]] |= 1 << cell(x, y)
+    return tuple(masks)
+
+
+def decode(board, itemtypes, unknown):
+    """
+    :return: List of columns of item types, unknown cells are set to unknown.
+    """
+    grid = []
+    for x in range(WIDTH):
+        column = []
+        for y in range(HEIGHT):
+            index = item_at(board, cell(x, y))
+            column.append(unknown if index < 0 else itemtypes[index])
+        grid.append(column)
+    return grid
+
+
+def item_at(board, cell_index):
+    """
+    :return: Index of the item type at a cell, -1 if unknown.
+    """
+    for index, mask in enumerate(board):
+        if mask >> cell_index & 1:
+            return index
+    return -1
+
+
+def known(board):
+    """
+    :return: Mask of cells that are not unknown.
+    """
+    cells = 0
+    for mask in board:
+        cells |= mask
+    return cells
+
+
+def same_item(board, cell1, cell2):
+    """
+    :return: True if both cells hold the same item type, or both are unknown.
+    """
+    return item_at(board, cell1) == item_at(board, cell2)
+
+
+def swap(board, cell1, cell2):
+    bit1 = 1 << cell1
+    bit2 = 1 << cell2
+    both = bit1 | bit2
+    swapped = []
+    for mask in board:
+        present = mask & both
+        if present == bit1 or present == bit2:
+            # Item type is in only one of the cells, move it to the other.
+            mask ^= both
+        swapped.append(mask)
+    return tuple(swapped)
+
+
+def can_match(board, cell1, cell2):
+    """
+    Check if a swap lines up 3 of an item type, without doing the swap. Only lines through the swapped cells are
+    checked, lines already on the board are not.
+    """
+    index1 = item_at(board, cell1)
+    index2 = item_at(board, cell2)
+    # Lines through both cells can't match after a swap, the cells hold different items.
+    if index2 >= 0:
+        mask = board[index2]
+        for rest in LINE_RESTS[cell1]:
+            if mask & rest == rest and not rest >> cell2 & 1:
+                return True
+    if index1 >= 0:
+        mask = board[index1]
+        for rest in LINE_RESTS[cell2]:
+            if mask & rest == rest and not rest >> cell1 & 1:
+                return True
+    return False
+
+
+def matches(board):
+    """
+    Find lines of 3 or more of the same item type.
+    :return: Tuple of the mask of cleared cells for each item type.
+    """
+    cleared = []
+    for mask in board:
+        # Cells starting a line of 3, then spread back out to every cell of those lines.
+        horizontal = mask & mask >> HEIGHT & mask >> (2 * HEIGHT) & HORIZONTAL_STARTS
+        vertical = mask & mask >> 1 & mask >> 2 & VERTICAL_STARTS
+        cleared.append(horizontal | horizontal << HEIGHT | horizontal << (2 * HEIGHT) |
+                       vertical | vertical << 1 | vertical << 2)
+    return tuple(cleared)
+
+
+def _drop_column(keep, column):
+    """
+    :param keep: Bits of the cells in a column that are not cleared.
+    :param column: Bits of the cells in a column holding an item type.
+    :return: Column bits once kept cells have dropped to the bottom.
+    """
+    dropped = 0
+    # Which row in the new column to fill next.
+    ynew = HEIGHT - 1
+    for y in reversed(range(HEIGHT)):
+        if keep >> y & 1:
+            if column >> y & 1:
+                dropped |= 1 << ynew
+            ynew -= 1
+    return dropped
+
+COLUMN = (1 << HEIGHT) - 1
+# Dropped column bits indexed by [keep][column], see _drop_column.
+DROP_COLUMN = [[_drop_column(keep, column) for column in range(COLUMN + 1)] for keep in range(COLUMN + 1)]
+
+
+def drop(board, cleared):
+    """
+    Remove cleared cells and drop the items above them down. Cells left empty at the top become unknown.
+    :param cleared: Mask of all cleared cells.
+    """
+    keep = FULL & ~cleared
+    # Only columns with cleared cells change.
+    columns = [x * HEIGHT for x in range(WIDTH) if keep >> (x * HEIGHT) & COLUMN != COLUMN]
+    dropped = []
+    for mask in board:
+        for shift in columns:
+            column = DROP_COLUMN[keep >> shift & COLUMN][mask >> shift & COLUMN]
+            mask = mask & ~(COLUMN << shift) | column << shift
+        dropped.append(mask)
+    return tuple(dropped)
+
+
+def emptied(before, after):
+    """
+    :return: Mask of the cells left empty by clearing and dropping before into after, the top cells of each column
+    that lost items.
+    """
+    cells_before = known(before)
+    cells_after = known(after)
+    cells = 0
+    for shift in range(0, CELLS, HEIGHT):
+        lost = popcount(cells_before >> shift & COLUMN) - popcount(cells_after >> shift & COLUMN)
+        if lost > 0:
+            cells |= ((1 << lost) - 1) << shift
+    return cells
+
+
+def fill_random(board, rng=random, cells=None):
+    """
+    Replace unknown cells with random item types.
+    :param cells: Mask of the cells to fill, defaults to every unknown cell.
+    """
+    masks = list(board)
+    if cells is None:
+        cells = FULL & ~known(board)
+    for cell_index in range(CELLS):
+        if cells >> cell_index & 1:
+            masks[rng.randrange(len(masks))] |= 1 << cell_index
+    return tuple(masks)
+
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(mask):
+        return bin(mask).count('1')
+
+
+def describe(board, itemtypes):
+    """
+    :return: Multi line string of the board in the style of Grid.describe_grid.
+    """
+    desc = " " + "".join(str(x + 1) for x in range(WIDTH)) + "\n"
+    for y in range(HEIGHT):
+        row = str(y + 1)
+        for x in range(WIDTH):
+            index = item_at(board, cell(x, y))
+            row += "U" if index < 0 else itemtypes[index].name[0]
+        desc += row + "\n"
+    return desc
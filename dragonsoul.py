@@ -1,10 +1,18 @@
 import argparse
+import glob
+import json
+import numpy as np
 from grid import *
 from utility.logconfig import *
 import logging
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
+# Points for clearing a number of one element.
+clear_points = [0, 0, 0, 10, 15] + [20] * (bitboard.CELLS - 4)
+clear_points_array = np.array(clear_points)
+probability_points_array = np.array(probability_points)
+
 class Element(GridItemType):
     def __init__(self, name, image, factor):
         GridItemType.__init__(self, name, image)
@@ -23,46 +31,62 @@ class Board(Grid):
         self.energy_pos = (self.game_center[0] - 212,
                            self.game_window[3] - 112)
 
-    def update(self, compareprevious=False):
-        # Move the mouse out of the way so tooltip isn't there.
-        win32api.SetCursorPos((self.xoffset - 50, self.yoffset - 50))
-        time.sleep(0.01)
-        return Grid.update(self, compareprevious)
+    def update(self, compareprevious=False, incremental=True):
+        if self.live:
+            # Move the mouse out of the way so tooltip isn't there.
+            Mouse.move(self.xoffset - 50, self.yoffset - 50)
+            time.sleep(0.01)
+        return Grid.update(self, compareprevious, incremental)
 
-    def clear(self, probabilitypoints=True):
-        """
-        Mark gems as cleared and count points.
-        """
-        Grid.clear(self, probabilitypoints)
+    def get_parameters(self):
+        parameters = Grid.get_parameters(self)
+        parameters['count_factor'] = Board.count_factor
+        for element in Grid.GridItemTypes:
+            parameters[element.name.lower()] = element.factor
+        return parameters
 
-        # Count what is removed.
-        removed = {}
-        for itemtype in Grid.GridItemTypes:
-            removed[itemtype] = 0
+    def set_parameters(self, parameters):
+        Grid.set_parameters(self, parameters)
+        if 'count_factor' in parameters:
+            Board.count_factor = parameters['count_factor']
+        for element in Grid.GridItemTypes:
+            if element.name.lower() in parameters:
+                element.factor = parameters[element.name.lower()]
 
-        for x, y in [(x, y) for x in range(5) for y in range(5)]:
-            if self.cleared[x][y]:
-                removed[self.grid[x][y]] += 1
+    def score(self, removed, probabilitypoints=True):
+        """
+        Count points for the elements cleared.
+        """
         items_cleared = 0
         points = 0
-        for element, count in removed.items():
-            element_points = 0
-            if count > 0:
-                items_cleared += count
-            if count == 3:
-                element_points += 10
-            elif count == 4:
-                element_points += 15
-            if count >= 5:
-                element_points += 20
+        for element, count in zip(Grid.GridItemTypes, removed):
+            items_cleared += count
+            element_points = clear_points[count]
             if probabilitypoints:
                 points += element_points * element.factor
                 points += count * Board.count_factor
             else:
                 points += element_points
-        if probabilitypoints:
+        if probabilitypoints and Grid.samples <= 0:
             # Add some probabilitiy points based upon the number of gems cleared.
-            points += (1.0 - (0.8 ** items_cleared)) * items_cleared
+            points += probability_points[items_cleared]
+        return points
+
+    def score_batch(self, removed, probabilitypoints=True):
+        """
+        Count points for the elements cleared on each of a batch of boards, see score.
+        """
+        points = np.zeros(len(removed))
+        # Add element by element, in the same order as score so the totals round the same.
+        for index, element in enumerate(Grid.GridItemTypes):
+            counts = removed[:, index]
+            if probabilitypoints:
+                points += clear_points_array[counts] * element.factor
+                points += counts * Board.count_factor
+            else:
+                points += clear_points_array[counts]
+        if probabilitypoints and Grid.samples <= 0:
+            points += probability_points_array[removed.sum(axis=1)]
         return points
 
 Grid.GridItemTypes = [
@@ -110,6 +134,14 @@ if __name__ == '__main__':
     Warning: potentially 40^depth moves have to be tested. Increasing this
     exponentially increases processing time.
     """)
+    parser.add_argument('--time', type=float, default=0.0, help="""
+    Seconds to spend calculating each move. Searches one move deeper at a time until time runs out, --depth becomes
+    the max depth. Default is to always search the full depth.
+    """)
+    parser.add_argument('--samples', type=int, default=0, help="""
+    Estimate what clears once emptied cells are filled in by averaging this many random fills, instead of a bonus
+    based on the number cleared. Use with --simulate to compare average points.
+    """)
     parser.add_argument('--fast0', action='store_true', help="""
     If best move is a zero point move, perform the next submove without recalculating.
     Runs faster, but at expensive of higher average points.
@@ -120,6 +152,36 @@ if __name__ == '__main__':
     parser.add_argument('--simulate', action='store_true', help="""
     Enable simulation mode. Script will create a new random board and simulate best moves and results.
     """)
+    parser.add_argument('--games', type=int, default=0, help="""
+    With --simulate, play this many seeded random boards spread over the processes, then output results as JSON.
+    Energy per board defaults to 100.
+    """)
+    parser.add_argument('--seed', type=int, default=0, help="""
+    Seed of the first board played with --games, each following board uses the next seed.
+    """)
+    parser.add_argument('--tune', action='append', default=[], metavar='NAME=VALUES', help="""
+    With --simulate and --games, benchmark every combination of comma separated values of parameters, e.g.
+    --tune depth_factor=0.5,0.75,1.0. Can be given for more than one parameter. Parameters: depth_factor, samples,
+    count_factor, wind, electro, ice, fire, random.
+    """)
+    parser.add_argument('--batch', action='store_true', help="""
+    Simulate every move of a depth at once with NumPy instead of one board at a time. Always searches the full depth.
+    Also speeds up --samples of 32 or more.
+    """)
+    parser.add_argument('--capture-thread', action='store_true', help="""
+    Grab the game window continuously on a background thread, so reading the screen doesn't wait on grabbing it.
+    """)
+    parser.add_argument('--record', metavar='FILE', help="""
+    Record what is seen of the game, and clicks, to FILE so a session can be replayed.
+    """)
+    parser.add_argument('--from-image', metavar='PATH', help="""
+    Detect the board from a screenshot of the game window instead of the game, and output the best move as JSON. Given
+    a directory, every PNG in it is solved, spread over the processes, with the seconds taken to detect and solve each.
+    """)
+    parser.add_argument('--replay', metavar='PATH', help="""
+    Like --from-image for every frame of a recording made with --record, or of a directory of screenshots. Frames
+    where the screen didn't change are only solved once.
+    """)
     parser.add_argument('--calibrate', action='store_true', help="""
     Enable calibration mode. Given a mouse position, outputs color grid.
     """)
@@ -137,6 +199,18 @@ if __name__ == '__main__':
     if args.fast0:
         Grid.fast0 = True
 
+    if args.capture_thread:
+        Grid.capture_thread = True
+
+    if args.batch:
+        Grid.use_batch = True
+
+    if args.time > 0:
+        Grid.move_time = args.time
+
+    if args.samples > 0:
+        Grid.samples = args.samples
+
     # Broken by the current multiprocessing.
     #Grid.GridItemTypes = [
     #    Element('Wind', Color(109, 159, 46, 0), args.wind),
@@ -160,14 +234,45 @@ if __name__ == '__main__':
     if args.calibrate:
         board = Board(calibrate=True)
 
+    if args.replay:
+        board = Board(grid=[[None]*5]*5, depth=args.depth, processes=args.processes)
+        print(json.dumps(board.solve_replay(args.replay, args.depth), indent=2, sort_keys=True))
+        sys.exit(0)
+
+    if args.from_image:
+        board = Board(grid=[[None]*5]*5, depth=args.depth, processes=args.processes)
+        if os.path.isdir(args.from_image):
+            results = board.solve_images(sorted(glob.glob(os.path.join(args.from_image, '*.png'))), args.depth)
+        else:
+            board.start_pool()
+            try:
+                results = board.solve_image(args.from_image, args.depth)
+            finally:
+                board.stop_pool()
+            if results['move'] is not None:
+                logging.info("Best Move Sequence: {0}".format(results['move']))
+        print(json.dumps(results, indent=2, sort_keys=True))
+        sys.exit(0)
+
     if args.simulate:
-        board = Board(0, 0, [], depth=args.depth, processes=args.processes)
-        if args.energy < 1:
+        board = Board(grid=[[None]*5]*5, depth=args.depth, processes=args.processes)
+        if args.games > 0:
+            energy = args.energy if args.energy > 0 else 100
+            if args.tune:
+                try:
+                    results = board.tune(parse_choices(args.tune), args.games, args.depth, energy, args.seed)
+                except ValueError as e:
+                    parser.error(str(e))
+            else:
+                results = board.benchmark(args.games, args.depth, energy, args.seed)
+            print(json.dumps(results, indent=2, sort_keys=True))
+        elif args.energy < 1:
             board.simulate_play(args.depth)
         else:
             board.simulate_play(args.depth, args.energy)
+        sys.exit(0)
 
-    board = Board(depth=args.depth, processes=args.processes)
+    board = Board(depth=args.depth, processes=args.processes, record=args.record)
 
     logging.info("The starting grid appears to be:")
     board.print_grid()
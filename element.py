@@ -7,6 +7,7 @@ import os.path
 from utility.mouse import *
 from utility.screen import *
 from utility.logconfig import *
+from utility.templates import load_template, load_templates
 from PIL import ImageGrab, Image
 import logging
 import functools
@@ -14,148 +15,158 @@ import math
 import operator
 import time
 
-parser = argparse.ArgumentParser(description='Automatically spend elemental stones.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument('attempts', type=int, help="""
-How many upgrade attempts to do.
-""")
-parser.add_argument('--favor', help="List of rows to favor and the order to favor them in, separated by ,")
-parser.add_argument('--favorthreshold', type=int, default=0, help="Net amount required before favoring.")
-parser.add_argument('--ignore1', action='store_true', help="Ignore row 1.")
-parser.add_argument('--ignore2', action='store_true', help="Ignore row 2.")
-parser.add_argument('--ignore3', action='store_true', help="Ignore row 3.")
-parser.add_argument('--debug', action='store_true', help="Output in depth information to the log file.")
-args = parser.parse_args()
-
-
-loglevel = VERBOSE
-if args.debug:
-    loglevel = logging.DEBUG
-logconfig('element', loglevel)
-
-favor = []
-if args.favor:
-    for f in args.favor.split(','):
-        favor.append(int(f))
-
-
-upgrade_offset = (146, 225)
-upgrade_image = Image.open('element/Upgrade.png')
-
-game_window = get_game_window()
-
-game_center = (int((game_window[2] - game_window[0]) / 2) + game_window[0],
-               int((game_window[3] - game_window[1]) / 2) + game_window[1])
-
-# Give the game focus.
-safe_click_pos = (max(0, game_window[0] - 1), max(0, game_window[1]))
-Mouse.click(*safe_click_pos)
-time.sleep(0.200)
-
-expected_x = game_center[0] + upgrade_offset[0]
-expected_y = game_center[1] + upgrade_offset[1]
-# Calibrate upgrade_image offset.
-upgrade_pos = image_search(ImageGrab.grab(), upgrade_image, expected_x, expected_y, radius=10)
-if upgrade_pos[0] == -1:
-    logging.error("Failed to find upgrade button, expected it to be near {0}, {1}".format(expected_x, expected_y))
-    sys.exit(1)
-
-logging.log(VERBOSE, "Upgrade button found at: {0}, offset: {1},{2}".format(
-    upgrade_pos, expected_x - upgrade_pos[0], expected_y - upgrade_pos[1]))
-
-# Adjust pos to be a clicking position.
-upgrade_pos = (upgrade_pos[0] + int(upgrade_image.size[0] / 2), upgrade_pos[1] + int(upgrade_image.size[1] / 2))
-# Save button position offset from that.
-save_pos = (upgrade_pos[0] + 139, upgrade_pos[1])
-
-digit_positions = [
-    ((game_center[0] + 387, game_center[1] + 55), args.ignore1),
-    ((game_center[0] + 387, game_center[1] + 80), args.ignore2),
-    ((game_center[0] + 387, game_center[1] + 107), args.ignore3)
-]
-
+# Offsets of the levels gained digit of each row from the center of the game window.
+digit_offsets = [(387, 55), (387, 80), (387, 107)]
 digit_size = (14, 12)
 
-logging.info("Loading digits...")
-digits = []
-scriptdir = os.path.dirname(os.path.realpath(__file__))
-globstring = os.path.join(scriptdir, "element/digits/*.png")
-for file in glob.glob(globstring):
-    name = os.path.basename(file)
-    name, ext = os.path.splitext(name)
-    digits.append((name, Image.open(file)))
-    logging.log(VERBOSE, "Loaded digit: {0}".format(name))
 
+def load_digits():
+    logging.info("Loading digits...")
+    digits = []
+    for name, digit in load_templates("element/digits/*.png"):
+        digits.append((name, digit))
+        logging.log(VERBOSE, "Loaded digit: {0}".format(name))
+    return digits
+
+
+def read_digits(screengrab, digits, game_center, ignore=(False, False, False)):
+    """
+    Read the levels each row gained or lost by an upgrade.
+    :param digits: Digit templates, see load_digits.
+    :param ignore: For each row, True to not read it and count it as 0.
+    :return: List of the value of each row, or None if a digit wasn't recognized.
+    """
+    values = []
+    for (offsetx, offsety), skip in zip(digit_offsets, ignore):
+        if skip:
+            values.append(0)
+            continue
+        pos = (game_center[0] + offsetx, game_center[1] + offsety)
+        name, x, y = detect_image(screengrab, digits, *pos, radius=3)
+        if name is None:
+            return None
+        logging.log(VERBOSE, "Recognized digit: {0} Offset: {1}, {2}".format(name, x - pos[0], y - pos[1]))
+        values.append(int(name))
+    return values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Automatically spend elemental stones.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('attempts', type=int, help="""
+    How many upgrade attempts to do.
+    """)
+    parser.add_argument('--favor', help="List of rows to favor and the order to favor them in, separated by ,")
+    parser.add_argument('--favorthreshold', type=int, default=0, help="Net amount required before favoring.")
+    parser.add_argument('--ignore1', action='store_true', help="Ignore row 1.")
+    parser.add_argument('--ignore2', action='store_true', help="Ignore row 2.")
+    parser.add_argument('--ignore3', action='store_true', help="Ignore row 3.")
+    parser.add_argument('--debug', action='store_true', help="Output in depth information to the log file.")
+    args = parser.parse_args()
+
+
+    loglevel = VERBOSE
+    if args.debug:
+        loglevel = logging.DEBUG
+    logconfig('element', loglevel)
+
+    favor = []
+    if args.favor:
+        for f in args.favor.split(','):
+            favor.append(int(f))
+
+
+    upgrade_offset = (146, 225)
+    upgrade_image = load_template('element/Upgrade.png')
+
+    game_window = get_game_window()
+
+    game_center = (int((game_window[2] - game_window[0]) / 2) + game_window[0],
+                   int((game_window[3] - game_window[1]) / 2) + game_window[1])
+
+    # Give the game focus.
+    safe_click_pos = (max(0, game_window[0] - 1), max(0, game_window[1]))
+    Mouse.click(*safe_click_pos)
+    time.sleep(0.200)
+
+    expected_x = game_center[0] + upgrade_offset[0]
+    expected_y = game_center[1] + upgrade_offset[1]
+    # Calibrate upgrade_image offset.
+    upgrade_pos = image_search(ImageGrab.grab(), upgrade_image, expected_x, expected_y, radius=10)
+    if upgrade_pos[0] == -1:
+        logging.error("Failed to find upgrade button, expected it to be near {0}, {1}".format(expected_x, expected_y))
+        sys.exit(1)
 
-total_upgrade = 0
+    logging.log(VERBOSE, "Upgrade button found at: {0}, offset: {1},{2}".format(
+        upgrade_pos, expected_x - upgrade_pos[0], expected_y - upgrade_pos[1]))
 
+    # Adjust pos to be a clicking position.
+    upgrade_pos = (upgrade_pos[0] + int(upgrade_image.size[0] / 2), upgrade_pos[1] + int(upgrade_image.size[1] / 2))
+    # Save button position offset from that.
+    save_pos = (upgrade_pos[0] + 139, upgrade_pos[1])
 
-def save():
-    Mouse.click(*save_pos)
-    time.sleep(0.150)
-    timeout = time.time() + 5.0
-    while time.time() < timeout and Mouse.cursor_is_hand(save_pos):
-        time.sleep(0.150)
-        Mouse.click(*save_pos)
-    time.sleep(0.500)
-    if Mouse.cursor_is_hand(save_pos):
-        logging.error("Error while waiting for save button to respond.")
-        sys.exit(1)
+    ignore = [args.ignore1, args.ignore2, args.ignore3]
 
-for i in range(1, args.attempts + 1):
-    # Click Upgrade.
-    Mouse.click(*upgrade_pos)
-    time.sleep(0.050)
-    timeout = time.time() + 10.0
-    while time.time() < timeout and not Mouse.cursor_is_hand(upgrade_pos):
+    digits = load_digits()
+
+
+    total_upgrade = 0
+
+
+    def save():
+        Mouse.click(*save_pos)
+        time.sleep(0.150)
+        timeout = time.time() + 5.0
+        while time.time() < timeout and Mouse.cursor_is_hand(save_pos):
+            time.sleep(0.150)
+            Mouse.click(*save_pos)
+        time.sleep(0.500)
+        if Mouse.cursor_is_hand(save_pos):
+            logging.error("Error while waiting for save button to respond.")
+            sys.exit(1)
+
+    for i in range(1, args.attempts + 1):
+        # Click Upgrade.
+        Mouse.click(*upgrade_pos)
         time.sleep(0.050)
-    if time.time() > timeout:
-        logging.error("Error while waiting for upgrade button to respond.")
-        sys.exit(1)
-    time.sleep(0.250)
-    # Get the digit values.
-    timeout = time.time() + 8.0
-    failure = False
-    while time.time() < timeout:
-        digit_total = 0
-        screengrab = ImageGrab.grab()
-        digit_values = []
-        for pos, ignore in digit_positions:
-            if ignore:
-                digit_values.append(0)
-                continue
-            name, x, y = detect_image(screengrab, digits, *pos, radius=3)
-            if name is None:
-                logging.debug("Failed to recognize digit, retrying in 100ms.")
-                time.sleep(0.100)
-                failure = True
-                break
-            logging.log(VERBOSE, "Recognized digit: {0} Offset: {1}, {2}".format(name, x - pos[0], y - pos[1]))
-            digit_values.append((int(name)))
-            digit_total += int(name)
-        if not failure:
-            break
-    if time.time() > timeout:
-        logging.error("Failed to recognize the digits.")
-        sys.exit(1)
-    if digit_total > 0:
-        save()
-        total_upgrade += digit_total
-        logging.info("Gained {0} levels, {1} total, {2} per attempt.".format(
-            digit_total, total_upgrade, total_upgrade / i))
-    elif digit_total >= args.favorthreshold:
-        shift = False
-        for f in favor:
-            if digit_values[f - 1] > 0:
-                logging.info("Shifting points into favored row. Net change: {}".format(digit_total))
-                shift = True
-                break
-            elif digit_values[f - 1] < 0:
-                # If this isn't 0, we don't want to shift at all.
+        timeout = time.time() + 10.0
+        while time.time() < timeout and not Mouse.cursor_is_hand(upgrade_pos):
+            time.sleep(0.050)
+        if time.time() > timeout:
+            logging.error("Error while waiting for upgrade button to respond.")
+            sys.exit(1)
+        time.sleep(0.250)
+        # Get the digit values.
+        timeout = time.time() + 8.0
+        digit_values = None
+        while time.time() < timeout:
+            digit_values = read_digits(ImageGrab.grab(), digits, game_center, ignore)
+            if digit_values is not None:
                 break
-        if shift:
-            total_upgrade += digit_total
+            logging.debug("Failed to recognize digit, retrying in 100ms.")
+            time.sleep(0.100)
+        if digit_values is None:
+            logging.error("Failed to recognize the digits.")
+            sys.exit(1)
+        digit_total = sum(digit_values)
+        if digit_total > 0:
             save()
-
-
-logging.info("Total Gained Levels: {0}, {1} per attempt.".format(
-    total_upgrade, total_upgrade / args.attempts))
+            total_upgrade += digit_total
+            logging.info("Gained {0} levels, {1} total, {2} per attempt.".format(
+                digit_total, total_upgrade, total_upgrade / i))
+        elif digit_total >= args.favorthreshold:
+            shift = False
+            for f in favor:
+                if digit_values[f - 1] > 0:
+                    logging.info("Shifting points into favored row. Net change: {}".format(digit_total))
+                    shift = True
+                    break
+                elif digit_values[f - 1] < 0:
+                    # If this isn't 0, we don't want to shift at all.
+                    break
+            if shift:
+                total_upgrade += digit_total
+                save()
+
+
+    logging.info("Total Gained Levels: {0}, {1} per attempt.".format(
+        total_upgrade, total_upgrade / args.attempts))
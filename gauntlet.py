@@ -6,6 +6,7 @@ from utility.logconfig import *
 import argparse
 import os.path
 from loa import *
+from utility.templates import load_template
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -39,7 +40,7 @@ class Gauntlet:
             self.game = LeagueOfAngels()
         else:
             self.game = game
-        self.morale_image = Image.open(os.path.join(script_dir, "misc/Morale.png"))
+        self.morale_image = load_template("misc/Morale.png")
 
     def play(self, first, rounds=15):
         round_count = 0
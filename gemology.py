@@ -1,4 +1,7 @@
 import argparse
+import glob
+import json
+import numpy as np
 from grid import *
 from utility.logconfig import *
 from utility.mouse import *
@@ -6,6 +9,11 @@ import logging
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
+# Points for clearing a number of gems of one color.
+clear_points = [0, 0, 0, 10, 20] + [50] * (bitboard.CELLS - 4)
+clear_points_array = np.array(clear_points)
+probability_points_array = np.array(probability_points)
+
 class Board(Grid):
     def set_grid_pos(self):
         self.xoffset = self.game_center[0] - 265
@@ -14,48 +22,40 @@ class Board(Grid):
     def set_energy_pos(self):
         self.energy_pos = (self.game_center[0] - 340, self.game_center[1] - 257)
 
-    def clear(self, probabilitypoints=True):
+    def score(self, removed, probabilitypoints=True):
         """
-        Mark gems as cleared and count points.
+        Count points for the gems cleared.
         """
-        # Build in sets up the self.cleared grid.
-        Grid.clear(self, probabilitypoints)
-
-        # Count what is removed.
-        removed = {}
-        for itemtype in Grid.GridItemTypes:
-            removed[itemtype] = 0
-
-        for x, y in [(x, y) for x in range(5) for y in range(5)]:
-            if self.cleared[x][y]:
-                removed[self.grid[x][y]] += 1
-
         # Calculate points
         colors_cleared = 0
         gems_cleared = 0
         points = 0
-        for itemtype, count in removed.items():
+        for count in removed:
             if count > 0:
                 gems_cleared += count
                 colors_cleared += 1
-            if count == 3:
-                points += 10
-            elif count == 4:
-                points += 20
-            if count >= 5:
-                points += 50
+                points += clear_points[count]
         # If more than one color is cleared, there's a 30 point bonus.
         if colors_cleared > 1:
             points += 30
 
-        if probabilitypoints:
+        if probabilitypoints and Grid.samples <= 0:
             # Add some probabilitiy points based upon the number of gems cleared.
-            points += (1.0 - (0.8 ** gems_cleared)) * gems_cleared
+            points += probability_points[gems_cleared]
         # Not possible to gain more than 60 points on a single clear.
         if points > 60:
             points = 60
         return points
 
+    def score_batch(self, removed, probabilitypoints=True):
+        """
+        Count points for the gems cleared on each of a batch of boards, see score.
+        """
+        points = clear_points_array[removed].sum(axis=1) + np.where((removed > 0).sum(axis=1) > 1, 30, 0)
+        if probabilitypoints and Grid.samples <= 0:
+            points = points + probability_points_array[removed.sum(axis=1)]
+        return np.minimum(points, 60).astype(np.float64)
+
 Grid.GridItemTypes = [
     GridItemType('Red', script_dir + '/grid/gemology/Red.png'),
     GridItemType('Green', script_dir + '/grid/gemology/Green.png'),
@@ -81,6 +81,14 @@ if __name__ == '__main__':
     Warning: potentially 40^depth moves have to be tested. Increasing this
     exponentially increases processing time.
     """)
+    parser.add_argument('--time', type=float, default=0.0, help="""
+    Seconds to spend calculating each move. Searches one move deeper at a time until time runs out, --depth becomes
+    the max depth. Default is to always search the full depth.
+    """)
+    parser.add_argument('--samples', type=int, default=0, help="""
+    Estimate what clears once emptied cells are filled in by averaging this many random fills, instead of a bonus
+    based on the number cleared. Use with --simulate to compare average points.
+    """)
     parser.add_argument('--fast0', action='store_true', help="""
     If best move is a zero point move, perform the next submove without recalculating.
     Runs faster, but at expensive of higher average points.
@@ -91,6 +99,35 @@ if __name__ == '__main__':
     parser.add_argument('--simulate', action='store_true', help="""
     Enable simulation mode. Script will create a new random board and simulate best moves and results.
     """)
+    parser.add_argument('--games', type=int, default=0, help="""
+    With --simulate, play this many seeded random boards spread over the processes, then output results as JSON.
+    Energy per board defaults to 100.
+    """)
+    parser.add_argument('--seed', type=int, default=0, help="""
+    Seed of the first board played with --games, each following board uses the next seed.
+    """)
+    parser.add_argument('--tune', action='append', default=[], metavar='NAME=VALUES', help="""
+    With --simulate and --games, benchmark every combination of comma separated values of parameters, e.g.
+    --tune depth_factor=0.5,0.75,1.0. Can be given for more than one parameter. Parameters: depth_factor, samples.
+    """)
+    parser.add_argument('--batch', action='store_true', help="""
+    Simulate every move of a depth at once with NumPy instead of one board at a time. Always searches the full depth.
+    Also speeds up --samples of 32 or more.
+    """)
+    parser.add_argument('--capture-thread', action='store_true', help="""
+    Grab the game window continuously on a background thread, so reading the screen doesn't wait on grabbing it.
+    """)
+    parser.add_argument('--record', metavar='FILE', help="""
+    Record what is seen of the game, and clicks, to FILE so a session can be replayed.
+    """)
+    parser.add_argument('--from-image', metavar='PATH', help="""
+    Detect the board from a screenshot of the game window instead of the game, and output the best move as JSON. Given
+    a directory, every PNG in it is solved, spread over the processes, with the seconds taken to detect and solve each.
+    """)
+    parser.add_argument('--replay', metavar='PATH', help="""
+    Like --from-image for every frame of a recording made with --record, or of a directory of screenshots. Frames
+    where the screen didn't change are only solved once.
+    """)
     parser.add_argument('--calibrate', action='store_true', help="""
     Enable calibration mode. Given a mouse position, outputs color grid.
     """)
@@ -109,17 +146,60 @@ if __name__ == '__main__':
     if args.fast0:
         Grid.fast0 = True
 
+    if args.capture_thread:
+        Grid.capture_thread = True
+
+    if args.batch:
+        Grid.use_batch = True
+
+    if args.time > 0:
+        Grid.move_time = args.time
+
+    if args.samples > 0:
+        Grid.samples = args.samples
+
     if args.calibrate:
         board = Board(calibrate=True)
 
+    if args.replay:
+        board = Board(grid=[[None]*5]*5, depth=args.depth, processes=args.processes)
+        print(json.dumps(board.solve_replay(args.replay, args.depth), indent=2, sort_keys=True))
+        sys.exit(0)
+
+    if args.from_image:
+        board = Board(grid=[[None]*5]*5, depth=args.depth, processes=args.processes)
+        if os.path.isdir(args.from_image):
+            results = board.solve_images(sorted(glob.glob(os.path.join(args.from_image, '*.png'))), args.depth)
+        else:
+            board.start_pool()
+            try:
+                results = board.solve_image(args.from_image, args.depth)
+            finally:
+                board.stop_pool()
+            if results['move'] is not None:
+                logging.info("Best Move Sequence: {0}".format(results['move']))
+        print(json.dumps(results, indent=2, sort_keys=True))
+        sys.exit(0)
+
     if args.simulate:
-        board = Board(0, 0, [[None]*5]*5, depth=args.depth, processes=args.processes)
-        if args.energy < 1:
+        board = Board(grid=[[None]*5]*5, depth=args.depth, processes=args.processes)
+        if args.games > 0:
+            energy = args.energy if args.energy > 0 else 100
+            if args.tune:
+                try:
+                    results = board.tune(parse_choices(args.tune), args.games, args.depth, energy, args.seed)
+                except ValueError as e:
+                    parser.error(str(e))
+            else:
+                results = board.benchmark(args.games, args.depth, energy, args.seed)
+            print(json.dumps(results, indent=2, sort_keys=True))
+        elif args.energy < 1:
             board.simulate_play(args.depth)
         else:
             board.simulate_play(args.depth, args.energy)
+        sys.exit(0)
     if args.both:
-        board = Board(depth=args.depth, processes=args.processes)
+        board = Board(depth=args.depth, processes=args.processes, record=args.record)
         # Regular.
         Mouse.click(board.xoffset - 146, board.yoffset - 10)
         time.sleep(1.000)
@@ -135,7 +215,7 @@ if __name__ == '__main__':
         board.print_grid()
         board.play(-1, depth=args.depth)
     else:
-        board = Board(depth=args.depth, processes=args.processes)
+        board = Board(depth=args.depth, processes=args.processes, record=args.record)
         logging.info("The starting grid appears to be:")
         board.print_grid()
 
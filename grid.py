@@ -1,7 +1,6 @@
 __author__ = 'Jody Shumaker'
 
 import itertools
-import copy
 import sys
 import logging
 import time
@@ -10,15 +9,26 @@ from multiprocessing import Pool, cpu_count
 import signal
 from utility.logconfig import *
 
-from PIL import ImageGrab
+from PIL import Image
 
 from utility.mouse import *
 from utility.screen import *
+from utility.templates import draw_template, load_template, load_templates
+from utility.cache import LRUCache
+from utility.capture import Backend, Capture, ReplayBackend, search_box
+from utility.desktop import get_desktop
+from utility.recorder import Recorder
+from utility.stats import mean, percentile, ratio_confidence_interval
+import numpy as np
+import batch
+import bitboard
 
 # Adjustment factor for each level deep in move sequence.
 depth_factor = 0.75
 # Offset from center used for comparison.
 grid_compare_box = (-4, -4, 5, 5)
+# Estimated points for what may clear once unknown items fill in, indexed by the number of items cleared.
+probability_points = [(1.0 - (0.8 ** count)) * count for count in range(bitboard.CELLS + 1)]
 
 
 class Move:
@@ -62,12 +72,18 @@ class GridItemType:
     def __init__(self, name, image):
         self.name = name
         if image is not None:
-            self.image = Image.open(image)
+            self.image = load_template(image)
         else:
             self.image = None
         self.index = GridItemType.count
         GridItemType.count += 1
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Worker processes only simulate, leave the image behind.
+        state['image'] = None
+        return state
+
     def __hash__(self):
         return self.index
 
@@ -78,6 +94,135 @@ class GridItemType:
         return self.name
 
 
+class SearchTimeout(Exception):
+    """
+    Raised by Grid.search when the time for the current move has run out.
+    """
+    pass
+
+
+# Grid used by a worker process, set by init_worker.
+worker_grid = None
+
+
+def init_worker(grid, itemtypes, factor, debug, samples):
+    """
+    Set up a worker process to evaluate moves for grid. Settings that may have been changed after import are passed
+    in, as the worker may be a fresh process.
+    """
+    global worker_grid, depth_factor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Grid.GridItemTypes = itemtypes
+    Grid.debug = debug
+    Grid.samples = samples
+    depth_factor = factor
+    worker_grid = grid
+
+
+def evaluate_move(task):
+    """
+    Evaluate a move in a worker process.
+    :param task: (board, swap, depth, deadline) tuple.
+    :return: (node, search stats) tuple, node is None if the deadline passed. See Grid.search_stats.
+    """
+    board, swap, depth, deadline = task
+    worker_grid.reset_search_stats()
+    worker_grid.deadline = deadline
+    try:
+        node = worker_grid.evaluate(board, swap, depth)
+    except SearchTimeout:
+        node = None
+    worker_grid.deadline = None
+    return node, worker_grid.search_stats()
+
+
+def init_image_worker(grid, parameters, debug, use_batch):
+    """
+    Set up a worker process to solve screenshots, see Grid.solve_images. Unlike init_worker the item types of the
+    worker are kept, as recognizing needs their images.
+    """
+    global worker_grid
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Grid.debug = debug
+    Grid.use_batch = use_batch
+    grid.set_parameters(parameters)
+    worker_grid = grid
+
+
+def solve_image(task):
+    """
+    Solve a screenshot in a worker process, see Grid.solve_image.
+    :param task: (filename, depth) tuple.
+    """
+    filename, depth = task
+    return worker_grid.solve_image(filename, depth)
+
+
+def parse_choices(options):
+    """
+    :param options: List of strings of the form name=value1,value2
+    :return: dict of parameter name to list of value strings, see Grid.tune.
+    """
+    choices = {}
+    for option in options:
+        if '=' not in option:
+            raise ValueError("Expected name=value1,value2 not {0}".format(option))
+        name, values = option.split('=', 1)
+        choices[name.strip()] = [value.strip() for value in values.split(',')]
+    return choices
+
+
+def benchmark_game(task):
+    """
+    Play a benchmark game in a worker process, see Grid.simulate_game.
+    :param task: (seed, depth, energy, parameters) tuple.
+    """
+    seed, depth, energy, parameters = task
+    worker_grid.set_parameters(parameters)
+    return worker_grid.simulate_game(seed, depth, energy)
+
+
+class SyntheticGrid(Backend):
+    """
+    Capture backend that draws a grid of item images, to test recognition without the game.
+    """
+
+    def __init__(self, grid, xoffset=100, yoffset=100, size=(400, 400), background=(0, 0, 0)):
+        """
+        :param grid: List of columns of item types to draw, see Grid.grid. Unknown or None cells are left empty.
+        :param xoffset: Screen x of the center of the top left item, see Grid.xoffset.
+        :param background: Color to fill the screen with, or a PIL image of the size to draw on.
+        """
+        self.grid = grid
+        self.xoffset = xoffset
+        self.yoffset = yoffset
+        self.size = size
+        self.background = background
+
+    def render(self):
+        if isinstance(self.background, Image.Image):
+            image = self.background.copy()
+        else:
+            image = Image.new('RGB', self.size, self.background)
+        for x in range(5):
+            for y in range(5):
+                itemtype = self.grid[x][y]
+                if itemtype is None or itemtype.image is None:
+                    continue
+                draw_template(image, itemtype.image, self.xoffset + (x * 50) + grid_compare_box[0],
+                              self.yoffset + (y * 50) + grid_compare_box[1])
+        return image
+
+    def grab(self, box=None):
+        image = self.render()
+        if box is not None:
+            image = image.crop(box)
+        return image
+
+    def screen_size(self):
+        return self.size
+
+
 class Grid:
     """
     Abstraction of the 5x5 board grid applicable to both Gemology and Dragon Souls
@@ -85,12 +230,32 @@ class Grid:
     debug = False
     fast0 = False
     delay = 1.5
+    # Grab the game window on a background thread, see Capture.start_thread.
+    capture_thread = False
+    # Simulate all moves of a depth at once with the batch simulator, see batch.search.
+    use_batch = False
+    # With use_batch set, fill in emptied cells with the batch simulator once there are this many samples. Fewer are
+    # quicker one at a time.
+    batch_samples = 32
+    # Seconds to spend calculating a move, searching one depth deeper at a time. 0 to always search the full depth.
+    move_time = 0.0
+    # Max number of searched boards to remember the best move for.
+    transposition_size = 100000
+    # Max number of boards to remember the result of clearing matches for.
+    cascade_size = 200000
+    # Random fills of emptied cells to average when estimating what clears once they're filled in. 0 to use
+    # probability_points instead.
+    samples = 0
+    # Max number of boards to remember the estimate of filling in emptied cells for.
+    refill_size = 100000
     GridItemTypes = []
     # Special type for unknown grid items.
     GridItemTypeUnknown = GridItemType('Unknown', None)
 
-    def __init__(self, grid=None, depth=3, processes=-1, calibrate=False):
-        self.cleared = None
+    def __init__(self, grid=None, depth=3, processes=-1, calibrate=False, capture=None, record=None):
+        """
+        :param record: File to record the game window and clicks to, see record.
+        """
         self.depth = depth
         self.grid = None
         self.game_window = None
@@ -98,26 +263,46 @@ class Grid:
         self.xoffset = None
         self.yoffset = None
         self.energy_pos = None
+        # Playing the game, as opposed to a screenshot or simulation. Only then is the mouse moved.
+        self.live = False
+        # Where the screen is grabbed from, see utility.capture.
+        self.capture = Capture() if capture is None else capture
+        # Per cell (item type, x offset, y offset, pixels) from the last detection, see detect_cell.
+        self.cells = [[None] * 5 for x in range(5)]
+        # Best node found by search, by (board, depth).
+        self.transpositions = LRUCache(Grid.transposition_size)
+        # Result of cascade without random fills, by (board, probabilitypoints). Kept across moves.
+        self.cascades = LRUCache(Grid.cascade_size)
+        # Estimated points of filling in emptied cells, by (board, emptied cells).
+        self.refills = LRUCache(Grid.refill_size)
+        # Worker processes used by best_move, see start_pool.
+        self.pool = None
+        # Time at which search gives up, None to never give up.
+        self.deadline = None
+        # Last moves skipped as they can't clear anything, and moves skipped as another move leads to the same board.
+        self.filtered = 0
+        self.duplicates = 0
         if processes == -1:
             self.processes = cpu_count()
         else:
             self.processes = processes
 
-        self.selected_image = Image.open('grid/selected.png')
+        self.selected_image = load_template('grid/selected.png')
 
         logging.info("Loading digits...")
         self.digits = []
-        scriptdir = os.path.dirname(os.path.realpath(__file__))
-        globstring = os.path.join(scriptdir, "grid/digits/*.png")
-        for file in glob.glob(globstring):
-            name = os.path.basename(file)
-            name, ext = os.path.splitext(name)
-            self.digits.append((name, Image.open(file)))
+        for name, digit in load_templates("grid/digits/*.png"):
+            self.digits.append((name, digit))
             logging.log(VERBOSE, "Loaded digit: {0}".format(name))
         if grid is None:
+            self.live = True
             self.game_window = get_game_window()
             self.game_center = (int((self.game_window[2] - self.game_window[0]) / 2) + self.game_window[0],
                                 int((self.game_window[3] - self.game_window[1]) / 2) + self.game_window[1])
+            if record is not None:
+                self.record(record)
+            if Grid.capture_thread:
+                self.capture.start_thread(self.game_window)
 
             # Give the game focus.
             safe_click_pos = (max(0, self.game_window[0] - 1), max(0, self.game_window[1]))
@@ -129,20 +314,10 @@ class Grid:
                 self.calibrate()
 
             #Move the mouse away
-            win32api.SetCursorPos((self.xoffset - 50, self.yoffset - 50))
+            Mouse.move(self.xoffset - 50, self.yoffset - 50)
             time.sleep(0.050)
-            screengrab = ImageGrab.grab()
-
-            # Adjust the offset.
-            logging.info("Searching for top left item...")
-            logging.log(VERBOSE, "Searching around {0},{1}".format(self.xoffset, self.yoffset))
-            griditem, offsetx, offsety = self.detect_item_type(screengrab, self.xoffset, self.yoffset, radius=20)
-            if griditem is None:
-                logging.error('Failed to find top left item.')
+            if not self.locate(self.capture.grab()):
                 sys.exit(1)
-            self.xoffset += offsetx
-            self.yoffset += offsety
-            logging.log(VERBOSE, "Centered on {0},{1}, item {2}".format(self.xoffset, self.yoffset, griditem.name))
 
             timeout = time.time() + 10
             while not self.update() and time.time() < timeout:
@@ -154,6 +329,106 @@ class Grid:
             #Use the supplied grid.
             self.grid = grid
 
+    def locate(self, screengrab):
+        """
+        Center xoffset, yoffset, as set by set_grid_pos, on the top left item.
+        :return: True if the top left item was found.
+        """
+        logging.info("Searching for top left item...")
+        logging.log(VERBOSE, "Searching around {0},{1}".format(self.xoffset, self.yoffset))
+        griditem, offsetx, offsety = self.detect_item_type(screengrab, self.xoffset, self.yoffset, radius=20)
+        if griditem is None:
+            logging.error('Failed to find top left item.')
+            return False
+        self.xoffset += offsetx
+        self.yoffset += offsety
+        logging.log(VERBOSE, "Centered on {0},{1}, item {2}".format(self.xoffset, self.yoffset, griditem.name))
+        return True
+
+    def recognize(self, image):
+        """
+        Detect the grid from a screenshot of the game window, such as one saved by loa.py, instead of the game.
+        :param image: PIL image or file name.
+        :return: True if the grid was detected.
+        """
+        backend = ReplayBackend([image])
+        self.capture = Capture(backend=backend)
+        width, height = backend.screen_size()
+        self.game_window = (0, 0, width, height)
+        self.game_center = (int(width / 2), int(height / 2))
+        self.set_grid_pos()
+        if not self.locate(self.capture.grab()):
+            return False
+        self.grid = None
+        return self.update(incremental=False)
+
+    def solve_image(self, filename, depth):
+        """
+        Detect the grid from a screenshot and find the best move, see recognize.
+        :param filename: File name or PIL image of the screenshot.
+        :return: dict of the file, the grid and move found, and the seconds each took.
+        """
+        result = {'file': filename if isinstance(filename, str) else None,
+                  'grid': None, 'move': None, 'points': None}
+        starttime = time.time()
+        recognized = self.recognize(filename)
+        result['recognize_seconds'] = time.time() - starttime
+        result['recognized'] = recognized
+        if recognized:
+            result['grid'] = self.describe_grid()
+            starttime = time.time()
+            move = self.best_move(depth, thread=self.pool is not None)
+            result['solve_seconds'] = time.time() - starttime
+            if move is not None:
+                result['move'] = move.describe()
+                result['points'] = move.get_total_points()
+        return result
+
+    def solve_images(self, filenames, depth):
+        """
+        Solve screenshots spread over worker processes, see solve_image.
+        :return: dict of the results of each file, and percentiles of the seconds taken.
+        """
+        starttime = time.time()
+        tasks = [(filename, depth) for filename in filenames]
+        if self.processes > 1 and len(filenames) > 1:
+            pool = Pool(processes=self.processes, initializer=init_image_worker,
+                        initargs=(self, self.get_parameters(), Grid.debug, Grid.use_batch))
+            try:
+                results = pool.map(solve_image, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self.solve_image(filename, depth) for filename in filenames]
+        recognize_times = [result['recognize_seconds'] for result in results]
+        solve_times = [result['solve_seconds'] for result in results if 'solve_seconds' in result]
+        summary = {
+            'files': results,
+            'depth': depth,
+            'processes': self.processes,
+            'recognized': sum(1 for result in results if result['recognized']),
+            'seconds': time.time() - starttime,
+        }
+        for name, times in [('recognize', recognize_times), ('solve', solve_times)]:
+            if times:
+                summary[name + '_p50'] = percentile(times, 50)
+                summary[name + '_p95'] = percentile(times, 95)
+        return summary
+
+    def solve_replay(self, path, depth):
+        """
+        Solve every frame of a recording or directory of screenshots, see ReplayBackend.from_path and solve_images.
+        :return: dict as solve_images, each result also has the index of its frame.
+        """
+        frames = ReplayBackend.from_path(path).frames
+        # A recording repeats the same image while the screen is unchanged, only solve each board once.
+        indexes = [index for index in range(len(frames)) if index == 0 or frames[index] is not frames[index - 1]]
+        summary = self.solve_images([frames[index] for index in indexes], depth)
+        for index, result in zip(indexes, summary['files']):
+            result['frame'] = index
+        return summary
+
     @staticmethod
     def detect_item_type(screengrab, x, y, radius=2):
         searchx = x + grid_compare_box[0]
@@ -176,51 +451,108 @@ class Grid:
         self.energy_pos = (0, 0)
         raise Exception("set_energy_pos must be overridden.")
 
-    def copy_grid(self):
+    def encode(self, grid=None):
         """
-        Copies our existing grid array to separate from a prior copy of this class
-        :return:
+        :return: self.grid, or the given grid, as a compact board for simulation.
         """
-        newgrid = []
-        for x in range(5):
-            column = []
-            for y in range(5):
-                column.append(self.grid[x][y])
-            newgrid.append(column)
-        self.grid = newgrid
+        if grid is None:
+            grid = self.grid
+        return bitboard.encode(grid, Grid.GridItemTypes)
 
-    def update(self, compareprevious=False):
-        screengrab = ImageGrab.grab()
+    def decode(self, board):
+        """
+        :return: List of columns of item types for a compact board.
+        """
+        return bitboard.decode(board, Grid.GridItemTypes, Grid.GridItemTypeUnknown)
+
+    def item_at(self, board, cell):
+        index = bitboard.item_at(board, cell)
+        if index < 0:
+            return Grid.GridItemTypeUnknown
+        return Grid.GridItemTypes[index]
+
+    @staticmethod
+    def cell_pixels(screengrab, x, y):
+        """
+        :return: Raw pixels of the box compared against item images, for an item detected at x, y.
+        """
+        return screengrab.crop((x + grid_compare_box[0], y + grid_compare_box[1],
+                                x + grid_compare_box[2], y + grid_compare_box[3])).tobytes()
+
+    def grid_box(self):
+        """
+        :return: Bounding box of the screen covering the grid and the area searched around it.
+        """
+        return self.xoffset - 50, self.yoffset - 50, self.xoffset + 250, self.yoffset + 250
+
+    def detect_cell(self, screengrab, x, y):
+        """
+        Detect the item type in a cell. Cells whose pixels are the same as the last update keep their item type,
+        otherwise items are first compared at the offset they were last found at, only searching around the cell if
+        none match.
+        :return: (item type, method) tuple, item type is None if detection failed. Method is one of 'unchanged',
+        'offset' or 'search'.
+        """
+        posx = self.xoffset + (x * 50)
+        posy = self.yoffset + (y * 50)
+        previous = self.cells[x][y]
+        if previous is not None:
+            itemtype, offsetx, offsety, pixels = previous
+            current = self.cell_pixels(screengrab, posx + offsetx, posy + offsety)
+            if current == pixels:
+                return itemtype, 'unchanged'
+            itemtype, foundx, foundy = self.detect_item_type(screengrab, posx + offsetx, posy + offsety, radius=0)
+            if itemtype is not None:
+                self.cells[x][y] = (itemtype, offsetx, offsety, current)
+                return itemtype, 'offset'
+        itemtype, offsetx, offsety = self.detect_item_type(screengrab, posx, posy)
+        if itemtype is None:
+            self.cells[x][y] = None
+        else:
+            self.cells[x][y] = (itemtype, offsetx, offsety,
+                                self.cell_pixels(screengrab, posx + offsetx, posy + offsety))
+        return itemtype, 'search'
+
+    def update(self, compareprevious=False, incremental=True):
+        """
+        Detect the grid from the screen.
+        compareprevious: Warn if no item changed.
+        incremental: Only detect cells that changed since the last update, see detect_cell.
+        :return: True if the grid was updated.
+        """
+        if not incremental:
+            self.cells = [[None] * 5 for x in range(5)]
+        starttime = time.time()
+        # Grid must be read as it is now, not from a frame buffered before the last move finished.
+        screengrab = self.capture.grab(self.grid_box(), since=starttime)
         newgrid = []
         item_changed = False
         update_failed = 0
+        methods = {'unchanged': 0, 'offset': 0, 'search': 0}
         for x in range(5):
             column = []
             for y in range(5):
-                posx = self.xoffset + (x * 50)
-                posy = self.yoffset + (y * 50)
-                griditemtype, offsetx, offsety = self.detect_item_type(screengrab, posx, posy)
+                griditemtype, method = self.detect_cell(screengrab, x, y)
+                methods[method] += 1
                 if griditemtype is None:
                     update_failed += 1
                 elif compareprevious and griditemtype != self.grid[x][y]:
                     item_changed = True
                 column.append(griditemtype)
             newgrid.append(column)
+        logging.log(VERBOSE, "Detected grid in {0:.3f}s, {1} unchanged, {2} at previous offset, {3} searched".format(
+            time.time() - starttime, methods['unchanged'], methods['offset'], methods['search']))
 
         if update_failed > 0:
             logging.log(VERBOSE, "Failed to update the grid for {} items".format(update_failed))
             return False
         if compareprevious and not item_changed:
             logging.warning("Grid did not change.")
-        oldgrid = self.grid
-        self.grid = newgrid
-
         # Make sure the game didn't enter some bad state.
-        self.clear()
-        if self.drop() > 0:
+        if bitboard.known(bitboard.matches(self.encode(newgrid))) != 0:
             logging.warning("The updated grid contains gems that should have cleared.")
-            self.grid = oldgrid
             return False
+        self.grid = newgrid
 
         return True
 
@@ -236,8 +568,6 @@ class Grid:
             for x in range(5):
                 if self.grid[x][y] is None:
                     row += " {0:>10}".format("Empty")
-                elif self.cleared is not None and self.cleared[x][y]:
-                    row += " {0:>7}(c)".format(self.grid[x][y].name)
                 else:
                     row += " {0:>10}".format(self.grid[x][y].name)
             desc += row + "\n"
@@ -255,8 +585,6 @@ class Grid:
             for x in range(5):
                 if self.grid[x][y] is None:
                     row += " "
-                elif self.cleared is not None and self.cleared[x][y]:
-                    row += self.grid[x][y].name[0].lower()
                 else:
                     row += self.grid[x][y].name[0]
             desc += row + "\n"
@@ -265,89 +593,306 @@ class Grid:
     def print_grid(self):
         logging.info("Grid\n" + self.describe_grid())
 
-    def process_move_multiprocess(self, move):
-        signal.signal(signal.SIGINT, signal.SIG_IGN)
-        newboard = copy.copy(self)
-        newboard.copy_grid()
-        newboard.swap(move)
-        move.points, move.submove = newboard.simulate(self.depth)
-        return move
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Worker processes only simulate, leave behind what's used for the screen. They also build their own
+        # transposition table.
+        state['digits'] = []
+        state['selected_image'] = None
+        state['cells'] = None
+        state['capture'] = None
+        state['pool'] = None
+        state['transpositions'] = LRUCache(self.transpositions.maxsize)
+        state['refills'] = LRUCache(self.refills.maxsize)
+        state['cascades'] = LRUCache(self.cascades.maxsize)
+        return state
+
+    def reset_search_stats(self):
+        self.transpositions.reset_stats()
+        self.cascades.reset_stats()
+        self.filtered = 0
+        self.duplicates = 0
+
+    def search_stats(self):
+        """
+        :return: Counters since reset_search_stats, a tuple of (transposition hits, transposition misses,
+        cascade hits, cascade misses, filtered moves, duplicate moves).
+        """
+        return (self.transpositions.hits, self.transpositions.misses, self.cascades.hits, self.cascades.misses,
+                self.filtered, self.duplicates)
 
-    def best_move(self, depth=2, thread=False):
+    def add_search_stats(self, stats):
         """
-        Find the best move.
-        depth: How many moves deep to simulate.
-        How many simulations get run can be calculated as 40^depth,
-        However it will ignore useless moves like swapping identical colors
+        Add counters from a search in a worker process, see search_stats.
         """
-        best_move = None
+        self.transpositions.hits += stats[0]
+        self.transpositions.misses += stats[1]
+        self.cascades.hits += stats[2]
+        self.cascades.misses += stats[3]
+        self.filtered += stats[4]
+        self.duplicates += stats[5]
+
+    def log_search_stats(self):
+        # Entries are only those of this process, the counters include worker processes.
+        for name, cache in [("Transposition table", self.transpositions), ("Cascade cache", self.cascades)]:
+            logging.log(VERBOSE, "{0}: {1} entries, {2} hits, {3} misses, {4:.1%} hit rate".format(
+                name, len(cache), cache.hits, cache.misses, cache.hit_rate()))
+        logging.log(VERBOSE, "Filtered {0} last moves that clear nothing, {1} duplicate moves".format(
+            self.filtered, self.duplicates))
+
+    def record(self, filename):
+        """
+        Record the game window as it is grabbed, and clicks, see utility.recorder. Play back with
+        ReplayBackend.from_recording.
+        """
+        self.capture.recorder = Recorder(filename, self.game_window)
+        Mouse.recorder = self.capture.recorder
 
-        possible_moves = []
+    def start_pool(self):
+        """
+        Start the worker processes used by best_move. They're kept running until stop_pool, each is sent a copy of
+        this grid once at startup and then only boards to evaluate.
+        """
+        if self.pool is None and self.processes > 1:
+            logging.debug("Launching {0} processes...".format(self.processes))
+            self.pool = Pool(processes=self.processes, initializer=init_worker,
+                             initargs=(self, Grid.GridItemTypes, depth_factor, Grid.debug, Grid.samples))
+
+    def stop_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
 
-        for x, y in [(x, y) for x in range(4) for y in range(4)]:
-            # Swap right
-            possible_moves.append(Move(x, y, self.grid[x][y], x+1, y, self.grid[x+1][y]))
-            # Swap down
-            possible_moves.append(Move(x, y, self.grid[x][y], x, y+1, self.grid[x][y+1]))
-        # Check bottom row moves.
-        y = 4
-        for x in range(4):
-            # Swap right
-            possible_moves.append(Move(x, y, self.grid[x][y], x+1, y, self.grid[x+1][y]))
-        # Check right column moves.
-        x = 4
-        for y in range(4):
-            # Swap down
-            possible_moves.append(Move(x, y, self.grid[x][y], x, y+1, self.grid[x][y+1]))
+    @staticmethod
+    def better(node, best):
+        """
+        :return: True if a node from search is better than the best node so far.
+        """
+        if best is None or node[0] > best[0]:
+            return True
+        elif node[0] == best[0]:
+            # Favor the move that acquries points earlier.
+            best_subnode = best[3]
+            subnode = node[3]
+            while best_subnode is not None and subnode is not None:
+                if subnode[1] > best_subnode[1]:
+                    return True
+                best_subnode = best_subnode[3]
+                subnode = subnode[3]
+        return False
+
+    def possible_swaps(self, board):
+        """
+        :return: Swaps on a compact board, stripped of useless ones where the 2 items are equal, in random order so
+        we don't favor some specific order.
+        """
+        swaps = [swap for swap in bitboard.SWAPS if not bitboard.same_item(board, *swap)]
+        random.shuffle(swaps)
+        return swaps
 
-        # Strip useless moves. We only want moves where the 2 items to swap are not equal.
-        possible_moves = [move for move in possible_moves if self.grid[move.x1][move.y1] != self.grid[move.x2][move.y2]]
+    def unique_moves(self, board, swaps, last=False):
+        """
+        Simulate swaps on a compact board, keeping one move per resulting board. Moves to the same board have the same
+        following moves, only the one giving the most points can be the best.
+        :param last: No moves follow these, so skip swaps that don't clear anything.
+        :return: List of (points, swap, board after) tuples, most points first.
+        """
+        if last and any(bitboard.matches(board)):
+            # Everything clears something on a board that still has lines on it.
+            last = False
+        moves = []
+        for swap in swaps:
+            if last and not bitboard.can_match(board, *swap):
+                self.filtered += 1
+                continue
+            points, after = self.expected_cascade(bitboard.swap(board, *swap))
+            moves.append((points, swap, after))
+        # Most points first, so the move kept for each resulting board is the one giving the most points.
+        moves.sort(key=lambda move: move[0], reverse=True)
+        unique = []
+        seen = set()
+        for move in moves:
+            if move[2] in seen:
+                self.duplicates += 1
+                continue
+            seen.add(move[2])
+            unique.append(move)
+        if last and not unique and swaps:
+            # No swap clears anything, any of them is worth 0.
+            unique.append((0, swaps[0], bitboard.swap(board, *swaps[0])))
+        return unique
+
+    def evaluate(self, board, swap, depth):
+        """
+        Simulate a swap on a compact board, then the best moves following it.
+        :return: Node for the swap, see search.
+        """
+        points, board = self.expected_cascade(bitboard.swap(board, *swap))
+        return self.follow(points, swap, board, depth)
+
+    def follow(self, points, swap, board, depth):
+        """
+        Add the best moves following a swap.
+        :param points: Points the swap gave.
+        :param board: Compact board after the swap.
+        :return: Node for the swap, see search.
+        """
+        if Grid.debug:
+            logging.debug("Depth: {0} Testing move: {1}<->{2}".format(
+                depth, bitboard.position(swap[0]), bitboard.position(swap[1])))
+        total = points
+        subnode = None
+        if depth > 1:
+            subnode = self.search(board, depth - 1)
+            if subnode is not None:
+                total += subnode[0] * depth_factor
+        return total, points, swap, subnode
 
-        # Shuffle the moves so we don't favor some specific order.
-        random.shuffle(possible_moves)
+    def search(self, board, depth):
+        """
+        Find the best sequence of moves on a compact board.
+        depth: How many moves deep to simulate.
+        :return: Node of the best move, None if there is no possible move. A node is a tuple of
+        (total points, points, swap, subnode), swap being a pair of cells and subnode the node for the best following
+        move or None.
+        """
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeout()
+        # Identical boards are reached by different move orders, reuse the result.
+        key = (board, depth)
+        cached = self.transpositions.get(key)
+        if cached is not None:
+            return cached[0]
+        best = None
+        for points, swap, after in self.unique_moves(board, self.possible_swaps(board), depth == 1):
+            node = self.follow(points, swap, after, depth)
+            if Grid.better(node, best):
+                best = node
+        self.transpositions.put(key, (best,))
+        return best
+
+    def build_move(self, board, node):
+        """
+        Convert a node from search into a Move chain.
+        """
+        cell1, cell2 = node[2]
+        x1, y1 = bitboard.position(cell1)
+        x2, y2 = bitboard.position(cell2)
+        move = Move(x1, y1, self.item_at(board, cell1), x2, y2, self.item_at(board, cell2))
+        move.points = node[1]
+        if node[3] is not None:
+            points, board = self.cascade(bitboard.swap(board, cell1, cell2))
+            move.submove = self.build_move(board, node[3])
+        return move
 
+    def search_root(self, board, swaps, depth, thread=False, deadline=None):
+        """
+        Evaluate each of the first moves on a compact board.
+        :param swaps: Swaps to evaluate, in order.
+        :param deadline: Time at which to give up, None to never give up.
+        :return: List of nodes in the order of swaps, None if the deadline passed.
+        """
         if thread and self.processes > 1:
-            # Let the other processes know what depth to start at.
-            self.depth = depth
-            # Spin up threads to calculate the submoves.
-            logging.debug("Launching 4 threads...")
+            # Use the session's worker processes, or start them just for this move.
+            stop_pool = self.pool is None
+            self.start_pool()
+            tasks = [(board, swap, depth, deadline) for swap in swaps]
             try:
-                pool = Pool(processes=self.processes)
-                result = pool.map_async(self.process_move_multiprocess, possible_moves)
+                result = self.pool.map_async(evaluate_move, tasks)
                 while not result.ready():
                     time.sleep(0.010)
-                possible_moves = result.get()
-                pool.close()
+                results = result.get()
             except KeyboardInterrupt:
-                pool.terminate()
+                self.pool.terminate()
                 sys.exit(1)
-        else:
-            for move in possible_moves:
-                if Grid.debug:
-                    logging.debug("Depth: {0} Testing move: {1}".format(depth, move.describe()))
-                newboard = copy.copy(self)
-                newboard.copy_grid()
-                newboard.swap(move)
-                move.points, move.submove = newboard.simulate(depth)
-
-        # Determine which was the best move.
-        for move in possible_moves:
-            if best_move is None:
-                best_move = move
-            elif move.get_total_points() > best_move.get_total_points():
-                best_move = move
-            elif move.get_total_points() == best_move.get_total_points():
-                # Favor the move that acquries points earlier.
-                best_submove = best_move.submove
-                submove = move.submove
-                while best_submove is not None and submove is not None:
-                    if submove.points > best_submove.points:
-                        best_move = move
-                        break
-                    best_submove = best_submove.submove
-                    submove = submove.submove
+            if stop_pool:
+                self.stop_pool()
+            nodes = []
+            for node, stats in results:
+                self.add_search_stats(stats)
+                nodes.append(node)
+            if None in nodes:
+                return None
+            return nodes
+
+        self.deadline = deadline
+        try:
+            return [self.evaluate(board, swap, depth) for swap in swaps]
+        except SearchTimeout:
+            return None
+        finally:
+            self.deadline = None
+
+    def best_move(self, depth=2, thread=False, move_time=None):
+        """
+        Find the best move.
+        depth: How many moves deep to simulate.
+        How many simulations get run can be calculated as 40^depth,
+        However it will ignore useless moves like swapping identical colors
+        move_time: Seconds to spend, searching one depth deeper at a time up to depth. The move from the deepest
+        completed search is used. Defaults to Grid.move_time, 0 to always search the full depth.
+        """
+        board = self.encode()
+        self.reset_search_stats()
+        if move_time is None:
+            move_time = Grid.move_time
 
-        return best_move
+        starttime = time.time()
+        swaps = self.possible_swaps(board)
+        # Only evaluate one first move per resulting board.
+        unique = set(move[1] for move in self.unique_moves(board, swaps))
+        swaps = [swap for swap in swaps if swap in unique]
+        if move_time > 0:
+            deadline = starttime + move_time
+            depths = range(1, depth + 1)
+        else:
+            deadline = None
+            depths = [depth]
+        best = None
+        completed = 0
+        if Grid.use_batch and Grid.samples <= 0:
+            # Fast enough to always search the full depth.
+            best = self.batch_node(board, depth)
+            depths = []
+            completed = depth
+        for current_depth in depths:
+            # Ignore the deadline until there's a move that gives points.
+            nodes = self.search_root(board, swaps, current_depth, thread,
+                                     deadline if best is not None and best[0] > 0 else None)
+            if nodes is None:
+                break
+            best = None
+            for node in nodes:
+                if Grid.better(node, best):
+                    best = node
+            completed = current_depth
+            # Search the best moves of this depth first at the next depth.
+            swaps = [node[2] for node in sorted(nodes, key=lambda node: node[0], reverse=True)]
+        if move_time > 0:
+            logging.log(VERBOSE, "Searched {0} of {1} moves deep in {2:.3f}s".format(
+                completed, depth, time.time() - starttime))
+        self.log_search_stats()
+
+        if best is None:
+            return None
+        return self.build_move(board, best)
+
+    def batch_node(self, board, depth):
+        """
+        Find the best sequence of moves on a compact board with the batch simulator.
+        :return: Node of the best move, see search.
+        """
+        totals, swaps = batch.search(batch.encode([board], len(Grid.GridItemTypes)), depth, self.score_batch,
+                                     len(Grid.GridItemTypes), depth_factor)
+        if swaps[0] < 0:
+            return None
+        swap = bitboard.SWAPS[swaps[0]]
+        points, after = self.cascade(bitboard.swap(board, *swap))
+        subnode = None
+        if depth > 1:
+            subnode = self.batch_node(after, depth - 1)
+        return float(totals[0]), points, swap, subnode
 
     def do_swap(self, swap, timeout=30.000):
 
@@ -366,26 +911,34 @@ class Grid:
             elif retry_count > 5:
                 logging.error("ERROR: cursor was not hand at intended click target.")
                 logging.error("Current: {0} Hand: {1} Arrow: {2}".format(
-                    Mouse.get_cursor(), Mouse.hand_cursor, Mouse.arrow_cursor))
+                    Mouse.get_cursor(), get_desktop().hand_cursor, get_desktop().arrow_cursor))
                 return False
             time.sleep(0.100)
         Mouse.click(x1, y1)
+        # Only grab around the reticule while waiting on it.
+        radius = 5
+        reticule_box = search_box(self.selected_image.size, x1 - 25, y1 - 25, radius)
         # Wait for selection reticule to come up.
         select_timeout = time.time() + 2.0
         while time.time() < select_timeout:
-            x, y = image_search(ImageGrab.grab(), self.selected_image, x1 - 25, y1 - 25)
+            x, y = image_search(self.capture.grab(reticule_box), self.selected_image, x1 - 25, y1 - 25, radius=radius)
             if x != -1:
                 logging.debug("Reticule offset: {0}, {1}".format(x - x1 + 25, y - y1 + 25))
                 break
+        # The two items swapping, and the reticule clearing, change the cells swapped.
+        swap_box = (min(x1, x2) - 25, min(y1, y2) - 25, max(x1, x2) + 25, max(y1, y2) + 25)
+        reference = self.capture.grab(swap_box)
         starttime = time.time()
         Mouse.click(x2, y2)
-        deselect_timeout = time.time() + 2.0
-        while time.time() < deselect_timeout:
-            x, y = image_search(ImageGrab.grab(), self.selected_image, x1 - 25, y1 - 25)
-            if x == -1:
-                break
-        time.sleep(0.100)
+        frame = self.capture.wait_for_change(swap_box, 2.0, reference)
+        if frame is not None:
+            logging.debug("Swap started {0:.3f}s after the swap click".format(frame.timestamp - starttime))
+        else:
+            logging.debug("Cells swapped did not change after the swap click")
         while True:
+            # Wait for items to stop moving, then check the game takes clicks again. A grid that never settles, such as
+            # one with idle animations, still has the cursor checked every half second.
+            self.capture.wait_for_stable(self.grid_box(), min(0.5, max(0.0, starttime + timeout - time.time())))
             # Jitter the mouse, or else it doesn't seem to always update.
             Mouse.move(x2-50, y2-50)
             Mouse.move(x2, y2)
@@ -395,13 +948,80 @@ class Grid:
             if starttime + timeout < time.time():
                 logging.error("Timed out waiting for move to complete.")
                 return False
-            time.sleep(0.100)
 
     def swap(self, swap):
         tempitem = self.grid[swap.x1][swap.y1]
         self.grid[swap.x1][swap.y1] = self.grid[swap.x2][swap.y2]
         self.grid[swap.x2][swap.y2] = tempitem
 
+    def cascade(self, board, probabilitypoints=True, fillrandom=False):
+        """
+        Clear matches on a compact board, dropping items and clearing again until nothing more clears.
+        fillrandom: Replace emptied cells with random items instead of leaving them unknown.
+        :return: (points, board) tuple
+        """
+        if fillrandom:
+            return self.clear_matches(board, probabilitypoints, fillrandom)
+        # Without random fills the result only depends on the board, and the same boards come up from many moves.
+        key = (board, probabilitypoints)
+        result = self.cascades.get(key)
+        if result is None:
+            result = self.clear_matches(board, probabilitypoints)
+            self.cascades.put(key, result)
+        return result
+
+    def clear_matches(self, board, probabilitypoints=True, fillrandom=False):
+        """
+        Uncached cascade.
+        """
+        points = 0
+        while True:
+            cleared = bitboard.matches(board)
+            cleared_cells = bitboard.known(cleared)
+            if cleared_cells == 0:
+                return points, board
+            points += self.score([bitboard.popcount(mask) for mask in cleared], probabilitypoints)
+            board = bitboard.drop(board, cleared_cells)
+            if fillrandom:
+                board = bitboard.fill_random(board)
+
+    def expected_cascade(self, board):
+        """
+        Clear matches on a compact board while searching, see cascade. With Grid.samples set, the points include an
+        estimate of what clears once emptied cells are filled in.
+        :return: (points, board) tuple
+        """
+        points, after = self.cascade(board)
+        if Grid.samples > 0:
+            cells = bitboard.emptied(board, after)
+            if cells:
+                points += self.refill_points(after, cells)
+        return points, after
+
+    def refill_points(self, board, cells):
+        """
+        Estimate the points from what clears once emptied cells are filled in, the average of Grid.samples random
+        fills. Fills are seeded by the board, so estimates are the same in every process and can be cached.
+        :param cells: Mask of the emptied cells.
+        """
+        key = (board, cells)
+        points = self.refills.get(key)
+        if points is None:
+            if Grid.use_batch and Grid.samples >= Grid.batch_samples:
+                types = len(Grid.GridItemTypes)
+                boards = batch.encode([board], types).repeat(Grid.samples, axis=0)
+                fill = np.array([bool(cells >> cell_index & 1) for cell_index in range(bitboard.CELLS)])
+                boards = batch.fill_random(boards, types, np.random.default_rng(hash(key) & 0xffffffffffffffff), fill)
+                points = float(batch.cascade(boards, self.score_batch, types)[0].mean())
+            else:
+                rng = random.Random(hash(key))
+                total = 0
+                for sample in range(Grid.samples):
+                    total += self.cascade(bitboard.fill_random(board, rng, cells))[0]
+                points = float(total) / Grid.samples
+            self.refills.put(key, points)
+        return points
+
     def simulate(self, depth=1, fillrandom=False, probabilitypoints=True):
         """
         Estimate how many points the current board would generate.
@@ -410,13 +1030,10 @@ class Grid:
         """
         if Grid.debug:
             logging.debug("Simulating board:\n{0}".format(self.describe_grid()))
-        
-        sub_move = None
-        points = self.clear(probabilitypoints)
 
-        while self.drop() > 0:
-            self.fill(fillrandom)
-            points += self.clear(probabilitypoints)
+        sub_move = None
+        points, board = self.cascade(self.encode(), probabilitypoints, fillrandom)
+        self.grid = self.decode(board)
 
         if Grid.debug:
             logging.debug("Points: {0} End Board:\n{1}".format(points, self.describe_grid()))
@@ -427,81 +1044,184 @@ class Grid:
 
         return points, sub_move
 
-    def drop(self):
+    def score(self, removed, probabilitypoints=True):
         """
-        Examine grid for cleared gems, drop remaining gems above.
+        Calculate the points for a single clear.
+        removed: Count of items cleared for each item type, in the order of Grid.GridItemTypes.
+        probabilitypoints: Include estimated points for what may clear after unknown items are filled in, unless
+        Grid.samples is set to estimate them by filling them in.
         """
-        if self.cleared is None:
-            logging.error("No cleared data, can't drop.")
-            sys.exit(1)
-        drop_count = 0
-        # Drop the columns.
+        raise Exception("score must be overridden.")
+
+    def score_batch(self, removed, probabilitypoints=True):
+        """
+        Calculate the points for a clear on each of a batch of boards, see batch.cascade. Override with a vectorized
+        version of score.
+        :param removed: int array of shape (boards, item types) of the counts cleared.
+        :return: float array of points.
+        """
+        return np.array([self.score(list(counts), probabilitypoints) for counts in removed], dtype=np.float64)
+
+    def random_grid(self):
+        randomgrid = []
         for x in range(5):
-            newcolumn = [None, None, None, None, None]
-            # Which row in the old column to pull from.
-            yold = 4
-            for ynew in reversed(range(5)):
-                # Find the next uncleared gem.
-                while yold >= 0 and self.cleared[x][yold]:
-                    yold -= 1
-                if yold < 0:
-                    # Can't find uncleared item to drop.
-                    drop_count += 1
-                else:
-                    newcolumn[ynew] = self.grid[x][yold]
-                    yold -= 1
-            self.grid[x] = newcolumn
-        self.cleared = None
-        return drop_count
+            column = []
+            for y in range(5):
+                column.append(Grid.GridItemTypes[random.randrange(len(Grid.GridItemTypes))])
+            randomgrid.append(column)
+        return randomgrid
 
-    def fill(self, fillrandom=False):
+    def simulate_game(self, seed, depth=2, energy=100):
         """
-        Replace empty spots on the grid with unknown or random items.
+        Play a seeded random board until the energy is used, calculating moves without threads.
+        :return: (points, energy used, list of seconds taken to calculate each move) tuple
         """
-        for x, y in [(x, y) for x in range(5) for y in range(5)]:
-            if self.grid[x][y] is None:
-                if fillrandom:
-                    self.grid[x][y] = Grid.GridItemTypes[random.randrange(len(Grid.GridItemTypes))]
+        random.seed(seed)
+        # Cached results change which of equally good moves get picked, start fresh so a seed always plays the same.
+        self.transpositions.clear()
+        self.cascades.clear()
+        self.refills.clear()
+        self.grid = self.random_grid()
+        # Normalize the board so nothing is ready to clear.
+        self.simulate(fillrandom=True, probabilitypoints=False)
+        total_points = 0
+        used_energy = 0
+        move_times = []
+        while used_energy < energy:
+            starttime = time.time()
+            move = self.best_move(min(depth, energy - used_energy))
+            move_times.append(time.time() - starttime)
+            if move is None:
+                break
+            points = 0
+            while points == 0 and move is not None and used_energy < energy:
+                used_energy += 1
+                self.swap(move)
+                points, sub_move = self.simulate(fillrandom=True, probabilitypoints=False)
+                total_points += points
+                if Grid.fast0:
+                    move = move.submove
                 else:
-                    self.grid[x][y] = Grid.GridItemTypeUnknown
-
-    def clear_items(self, x1, y1, x2, y2, x3, y3):
-        if self.grid[x1][y1] == Grid.GridItemTypeUnknown or \
-                self.grid[x2][y2] == Grid.GridItemTypeUnknown or \
-                self.grid[x3][y3] == Grid.GridItemTypeUnknown:
-            return
-        elif self.grid[x1][y1] == self.grid[x2][y2] and self.grid[x2][y2] == self.grid[x3][y3]:
-            self.cleared[x1][y1] = True
-            self.cleared[x2][y2] = True
-            self.cleared[x3][y3] = True
-
-    def clear(self, probabilitypoints=True):
-        self.cleared = []
-        for x in range(5):
-            self.cleared.append([False]*5)
-        # Scan rows
-        for x, y in [(x, y) for x in range(3) for y in range(5)]:
-            self.clear_items(x, y, x+1, y, x+2, y)
-        # Scan columns
-        for x, y in [(x, y) for x in range(5) for y in range(3)]:
-            self.clear_items(x, y, x, y+1, x, y+2)
-        # Method should be overridden from here to calculate and return the points
-        return -1
+                    points = -1
+        return total_points, used_energy, move_times
 
-    def simulate_play(self, depth=2, energy=100):
+    def get_parameters(self):
+        """
+        :return: dict of the settings that change which moves are picked, see set_parameters.
+        """
+        return {'depth_factor': depth_factor, 'samples': Grid.samples}
 
+    def set_parameters(self, parameters):
+        """
+        Change settings that change which moves are picked, clearing results calculated with the old settings.
+        :param parameters: dict of settings to change, see get_parameters.
+        """
+        global depth_factor
+        if 'depth_factor' in parameters:
+            depth_factor = parameters['depth_factor']
+        if 'samples' in parameters:
+            Grid.samples = parameters['samples']
+        self.transpositions.clear()
+        self.cascades.clear()
+        self.refills.clear()
+
+    def benchmark(self, games, depth=2, energy=100, seed=0, parameters=None):
+        """
+        Play a number of seeded random boards, spread over the worker processes.
+        :param parameters: Settings to play with, see set_parameters. Defaults to the current settings.
+        :return: dict of results.
+        """
+        if parameters is None:
+            parameters = self.get_parameters()
+        # Leave only warnings and errors, per move logging slows things down.
+        logging.disable(logging.INFO)
+        starttime = time.time()
+        tasks = [(seed + game, depth, energy, parameters) for game in range(games)]
+        stop_pool = self.pool is None
+        try:
+            self.start_pool()
+            if self.pool is None:
+                previous = self.get_parameters()
+                self.set_parameters(parameters)
+                try:
+                    results = [self.simulate_game(*task[:3]) for task in tasks]
+                finally:
+                    self.set_parameters(previous)
+            else:
+                try:
+                    result = self.pool.map_async(benchmark_game, tasks)
+                    while not result.ready():
+                        time.sleep(0.010)
+                    results = result.get()
+                except KeyboardInterrupt:
+                    self.pool.terminate()
+                    sys.exit(1)
+            duration = time.time() - starttime
+        finally:
+            if stop_pool:
+                self.stop_pool()
+            logging.disable(logging.NOTSET)
+
+        move_times = [move_time for points, used_energy, times in results for move_time in times]
+        points_per_energy, margin = ratio_confidence_interval(
+            [points for points, used_energy, times in results], [used_energy for points, used_energy, times in results])
+        return {
+            'parameters': parameters,
+            'games': games,
+            'depth': depth,
+            'energy': energy,
+            'seed': seed,
+            'processes': self.processes,
+            'samples': parameters.get('samples', Grid.samples),
+            'fast0': Grid.fast0,
+            'points_per_energy': points_per_energy,
+            # 95% confidence interval of the total points over the total energy.
+            'points_per_energy_low': points_per_energy - margin,
+            'points_per_energy_high': points_per_energy + margin,
+            'points_per_game': mean([points for points, used_energy, times in results]),
+            'move_time_p50': percentile(move_times, 50),
+            'move_time_p95': percentile(move_times, 95),
+            'move_time_p99': percentile(move_times, 99),
+            'boards_per_second': games / duration,
+            'seconds': duration,
+        }
+
+    def tune(self, choices, games, depth=2, energy=100, seed=0):
+        """
+        Benchmark every combination of parameter values. Every combination plays the same seeded boards, so
+        differences come from the parameters rather than luck.
+        :param choices: dict of parameter name to list of values to try, see get_parameters. Values are converted to
+        the type of the current value.
+        :return: List of benchmark results, best points per energy first.
+        """
+        current = self.get_parameters()
+        for name in choices:
+            if name not in current:
+                raise ValueError("Unknown parameter {0}, expected one of: {1}".format(
+                    name, ", ".join(sorted(current))))
+        names = sorted(choices)
+        values_list = [[type(current[name])(value) for value in choices[name]] for name in names]
+        results = []
+        for values in itertools.product(*values_list):
+            parameters = dict(current)
+            parameters.update(zip(names, values))
+            logging.info("Benchmarking {0}".format(", ".join(
+                "{0}={1}".format(name, value) for name, value in zip(names, values))))
+            result = self.benchmark(games, depth, energy, seed, parameters)
+            logging.info("Points per energy: {0:.2f} ({1:.2f} - {2:.2f})".format(
+                result['points_per_energy'], result['points_per_energy_low'], result['points_per_energy_high']))
+            results.append(result)
+        results.sort(key=lambda result: result['points_per_energy'], reverse=True)
+        return results
+
+    def simulate_play(self, depth=2, energy=100):
+        self.start_pool()
         starttime = time.time()
         total_points = 0
         total_moves = 0
         while True:
             # Do a simulation run of the given energy.
-            randomgrid = []
-            for x in range(5):
-                column = []
-                for y in range(5):
-                    column.append(Grid.GridItemTypes[random.randrange(len(Grid.GridItemTypes))])
-                randomgrid.append(column)
-            self.grid = randomgrid
+            self.grid = self.random_grid()
             # Normalize the board so nothing is ready to clear.
             self.simulate(fillrandom=True, probabilitypoints=False)
             logging.info("Random starting grid:")
@@ -513,7 +1233,7 @@ class Grid:
                     logging.error("Calculated move sequence gives zero points.")
                     sys.exit(1)
                 points = 0
-                while points == 0:
+                while points == 0 and move is not None:
                     total_moves += 1
                     sim_moves += 1
                     self.swap(move)
@@ -532,7 +1252,7 @@ class Grid:
     def parse_energy(self):
         energy = 0
         # Find the first digit.
-        screengrab = ImageGrab.grab()
+        screengrab = self.capture.grab()
         self.set_energy_pos()
 
         # Offsets for 4, 3, 2, and 1 digits from position of 1 digit.
@@ -571,58 +1291,67 @@ class Grid:
             if remaining_energy == 0:
                 return
 
-        startime = time.time()
-        startenergy = remaining_energy
-        while remaining_energy > 0:
-            retry_count = 0
-            while True:
-                if not self.update():
-                    retry_count += 1
-                    if retry_count >= 20:
-                        logging.error("Failed to accurately update board 20 times. Giving up.")
-                        sys.exit(1)
+        # Keep worker processes running for the whole session.
+        self.start_pool()
+        try:
+            startime = time.time()
+            startenergy = remaining_energy
+            while remaining_energy > 0:
+                retry_count = 0
+                while True:
+                    if not self.update():
+                        retry_count += 1
+                        if retry_count >= 20:
+                            logging.error("Failed to accurately update board 20 times. Giving up.")
+                            sys.exit(1)
+                        else:
+                            # Likely still animating, wait for the grid to settle. Retries are at least half a second
+                            # apart, so giving up still takes about 10 seconds on a board that can't be recognized.
+                            retrytime = time.time()
+                            self.capture.wait_for_stable(self.grid_box(), 0.5)
+                            time.sleep(max(0.0, retrytime + 0.5 - time.time()))
                     else:
-                        time.sleep(0.5)
-                else:
-                    break
+                        break
 
-            logging.log(VERBOSE, "Calculating move...")
-            movestartime = time.time()
-            if remaining_energy < depth:
-                move = self.best_move(depth=remaining_energy, thread=True)
-            else:
-                move = self.best_move(depth, thread=True)
-            duration = time.time() - movestartime
-            logging.log(VERBOSE, "Calculating best move took: {0:.3f}s".format(duration))
-            logging.info("Best Move Sequence: {0}".format(move.describe()))
-            if move.get_total_points() == 0.0:
-                logging.error("ERROR: Calculated move sequence gives zero points.")
-                sys.exit(1)
-            if remaining_energy <= depth and move.get_total_points() < 1.0:
-                logging.info("Not using last energy, no move gives points.")
-                break
-            lastmove_points = 0
-            # Iterate over moves until one is performed that is expected to give >0 points
-            while lastmove_points == 0:
-                remaining_energy -= 1
-                if not self.do_swap(move):
-                    sys.exit(1)
-                if Grid.fast0:
-                    lastmove_points = move.points
-                    move = move.submove
+                logging.log(VERBOSE, "Calculating move...")
+                movestartime = time.time()
+                if remaining_energy < depth:
+                    move = self.best_move(depth=remaining_energy, thread=True)
                 else:
-                    lastmove_points = -1
+                    move = self.best_move(depth, thread=True)
+                duration = time.time() - movestartime
+                logging.log(VERBOSE, "Calculating best move took: {0:.3f}s".format(duration))
+                logging.info("Best Move Sequence: {0}".format(move.describe()))
+                if move.get_total_points() == 0.0:
+                    logging.error("ERROR: Calculated move sequence gives zero points.")
+                    sys.exit(1)
+                if remaining_energy <= depth and move.get_total_points() < 1.0:
+                    logging.info("Not using last energy, no move gives points.")
+                    break
+                lastmove_points = 0
+                # Iterate over moves until one is performed that is expected to give >0 points
+                while lastmove_points == 0 and move is not None:
+                    remaining_energy -= 1
+                    if not self.do_swap(move):
+                        sys.exit(1)
+                    if Grid.fast0:
+                        lastmove_points = move.points
+                        move = move.submove
+                    else:
+                        lastmove_points = -1
 
-        duration = time.time() - startime
-        logging.info("Moves complete, total time: {0:.3f}s time per move: {1:.3f}s".format(
-            duration, duration / startenergy))
+            duration = time.time() - startime
+            logging.info("Moves complete, total time: {0:.3f}s time per move: {1:.3f}s".format(
+                duration, duration / startenergy))
+        finally:
+            self.stop_pool()
 
     def calibrate(self):
         # Select the top left item.
         Mouse.click(self.xoffset, self.yoffset)
         time.sleep(0.500)
         # Search for the target reticule to get exact positioning.
-        x, y = image_search(ImageGrab.grab(), self.selected_image, self.xoffset - 25, self.yoffset - 25, radius=15)
+        x, y = image_search(self.capture.grab(), self.selected_image, self.xoffset - 25, self.yoffset - 25, radius=15)
         if x != -1:
             logging.debug("Reticule offset: {0}, {1}".format(x - self.xoffset + 25, y - self.yoffset + 25))
         else:
@@ -641,7 +1370,7 @@ class Grid:
         time.sleep(0.100)
 
         grid_images = []
-        screengrab = ImageGrab.grab()
+        screengrab = self.capture.grab()
         for x in range(5):
             for y in range(5):
                 image = screengrab.crop((
@@ -1,20 +1,18 @@
-import win32api
-
 __author__ = 'Jody Shumaker'
 
 import argparse
 import datetime
-import win32gui
-import win32ui
-import win32con
-from ctypes import windll
 import logging
-from PIL import ImageGrab, Image
 import time
 from collections import namedtuple
 from enum import Enum
 import os.path
-import math
+from utility import matching
+from utility.matching import offset_scores
+from utility.templates import load_template
+from utility.capture import Capture, PrintWindowBackend, ReplayBackend, search_box
+from utility.desktop import get_desktop
+from utility.recorder import Recorder
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -22,10 +20,6 @@ Rect = namedtuple('Rect', ['left', 'top', 'right', 'bottom'])
 FoundPosition = namedtuple('FoundPosition', ['x', 'y', 'xoffset', 'yoffset'])
 
 
-def makelong(low, high):
-    return low | (high << 16)
-
-
 class SearchAlgorithm(Enum):
     Spiral = 0
     LeftToRight = 1
@@ -67,29 +61,6 @@ def search_offset(radius=2, offsetx=0, offsety=0, xradius=None, yradius=None, al
         raise ValueError("Invalid search algorithm specified.")
 
 
-def compare_images(i1, i2):
-    rms = 0.0
-    if i1.size != i2.size:
-        raise ValueError("Image sizes for comparison do not match. {0} vs {1}".format(i1.size, i2.size))
-    width, height = i1.size
-    for x in range(width):
-        for y in range(height):
-            pixel2 = i2.getpixel((x, y))
-            # Skip if fully transparent.
-            if len(pixel2) > 3 and pixel2[3] == 0:
-                continue
-            pixel1 = i1.getpixel((x, y))
-
-            pixel_rms = math.sqrt((pixel1[0] - pixel2[0])**2 + (pixel1[1] - pixel2[1])**2 + (pixel1[2] - pixel2[2])**2)
-            if len(pixel2) > 3:
-                # Second image has an alpha channel, let's scale our rms value by the alpha channel.
-                # This ignores fully transparent pixels, and can give less weight to partially transparent pixels.
-                rms += pixel_rms * pixel2[3] / 255
-            else:
-                rms += pixel_rms
-    return rms
-
-
 def image_search(screengrab, image, searchx, searchy, threshold=None, radius=5, great_threshold=None):
     """
     Search for an image in the screengrab starting at the given searchx and searchy coordinages, and expanding out
@@ -112,10 +83,14 @@ def image_search(screengrab, image, searchx, searchy, threshold=None, radius=5,
         # use an automatic value based upon size.
         great_threshold = image_width * image_height
 
+    # Score every offset at once, the spiral then only decides which match is taken.
+    scores = offset_scores(screengrab, image, searchx, searchy, radius, radius)
     best_x = -1
     best_y = -1
-    for x, y in search_offset(radius=radius, offsetx=searchx, offsety=searchy):
-        rms = compare_images(screengrab.crop((x, y, x + image_width, y + image_height)), image)
+    for x, y in search_offset(radius=radius):
+        rms = scores[y + radius, x + radius]
+        x += searchx
+        y += searchy
         logging.debug("Image Search {0},{1}  rms: {2:>10.3f}".format(x, y, rms))
         if best_rms is None or rms < best_rms:
             best_y = y
@@ -140,32 +115,34 @@ class Mode(Enum):
 
 
 class LeagueOfAngels:
-    def __init__(self, auto=True, screenshot=None, mode=Mode.Desktop):
+    def __init__(self, auto=True, screenshot=None, mode=Mode.Desktop, capture=None):
+        """
+        :param screenshot: Image to use instead of the game, the game is then the whole image.
+        :param capture: Capture to use instead of the game, such as one replaying recorded frames. The game is then the
+        whole screen of the capture.
+        """
         self.hwnd = None
         self.gamepos = None
         self.mode = mode
         self.screenshot = screenshot
-        if screenshot is None:
+        if capture is None and screenshot is not None:
+            capture = Capture(backend=ReplayBackend([screenshot]))
+        self.capture = capture
+        if capture is None:
             self.get_game_hwnd(auto=auto)
+            if self.mode == Mode.Window:
+                self.capture = Capture(backend=PrintWindowBackend(self.hwnd))
+            else:
+                self.capture = Capture()
             self.get_game_bbox()
         else:
-            self.gamepos = 0, 0, screenshot.size[0], screenshot.size[1]
+            width, height = capture.backend.screen_size()
+            self.gamepos = Rect(0, 0, width, height)
 
         self.resources = {}
 
     def get_game_hwnd(self, auto=True):
-        windows = []
-
-        def foreach_window(hwnd, lparam):
-            nonlocal windows
-            if win32gui.IsWindowVisible(hwnd):
-                window_text = win32gui.GetWindowText(hwnd)
-                if "League of Angels" in window_text:
-                    windows.append((hwnd, window_text))
-                    logging.debug("Found game window hwnd: {0} title: {1}".format(hwnd, window_text))
-            return True
-
-        win32gui.EnumWindows(foreach_window, None)
+        windows = get_desktop().find_windows("League of Angels")
         if len(windows) == 0:
             logging.error("Failed to find game window.")
             raise Exception("Failed to find game window.")
@@ -188,62 +165,41 @@ class LeagueOfAngels:
 
     def focus(self):
         # Make game window active.
-        win32gui.SetWindowPos(self.hwnd, win32con.HWND_TOP, 0, 0, 0, 0,
-                              win32con.SWP_NOMOVE + win32con.SWP_NOSIZE + win32con.SWP_SHOWWINDOW)
-        win32gui.SetForegroundWindow(self.hwnd)
-        win32gui.ShowWindow(self.hwnd, win32con.SW_RESTORE)
+        get_desktop().focus_window(self.hwnd)
         time.sleep(0.250)
 
     def capture_screenshot(self):
-        im = None
+        """
+        :return: PIL image of the game, or None if the grab failed.
+        """
+        frame = self.capture.grab()
+        if frame is None:
+            return None
+        return frame.image
 
-        if self.mode == Mode.Window:
-            left, top, right, bot = win32gui.GetClientRect(self.hwnd)
-            w = right - left
-            h = bot - top
-
-            hwnddc = win32gui.GetWindowDC(self.hwnd)
-            mfcdc = win32ui.CreateDCFromHandle(hwnddc)
-            savedc = mfcdc.CreateCompatibleDC()
-
-            savebitmap = win32ui.CreateBitmap()
-            savebitmap.CreateCompatibleBitmap(mfcdc, w, h)
-
-            savedc.SelectObject(savebitmap)
-
-            # Change the line below depending on whether you want the whole window
-            # or just the client area.
-            result = windll.user32.PrintWindow(self.hwnd, savedc.GetSafeHdc(), 1)
-            logging.debug("PrintWindow result: {}".format(result))
-
-            if result == 1:
-                bmpinfo = savebitmap.GetInfo()
-                logging.debug(bmpinfo)
-                bmpstr = savebitmap.GetBitmapBits(True)
-
-                im = Image.frombuffer(
-                    'RGB',
-                    (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
-                    bmpstr, 'raw', 'BGRX', 0, 1)
-
-            win32gui.DeleteObject(savebitmap.GetHandle())
-            savedc.DeleteDC()
-            mfcdc.DeleteDC()
-            win32gui.ReleaseDC(self.hwnd, hwnddc)
-        else:
-            im = ImageGrab.grab()
+    def record(self, filename):
+        """
+        Record the game as it is grabbed, and clicks, see utility.recorder. Play back with ReplayBackend.from_recording.
+        """
+        self.capture.recorder = Recorder(filename, self.gamepos)
 
-        return im
+    def start_capture_thread(self):
+        """
+        Grab the game continuously on a background thread, so searches take the newest frame instead of waiting on a
+        grab, see Capture.start_thread.
+        """
+        self.capture.start_thread(self.gamepos)
 
     def get_game_bbox(self):
         logging.debug("Searching for game bounding box within client area.")
         screenshot = self.capture_screenshot()
+        desktop = get_desktop()
         if self.mode == Mode.Window:
-            left, top, right, bottom = win32gui.GetClientRect(self.hwnd)
+            left, top, right, bottom = desktop.client_rect(self.hwnd)
         else:
-            clientleft, clienttop, clientright, clientbottom = win32gui.GetClientRect(self.hwnd)
-            left, top = win32gui.ClientToScreen(self.hwnd, (clientleft, clienttop))
-            right, bottom = win32gui.ClientToScreen(self.hwnd, (clientright, clientbottom))
+            clientleft, clienttop, clientright, clientbottom = desktop.client_rect(self.hwnd)
+            left, top = desktop.client_to_screen(self.hwnd, clientleft, clienttop)
+            right, bottom = desktop.client_to_screen(self.hwnd, clientright, clientbottom)
         logging.debug("Client rect: {},{},{},{}".format(left, top, right, bottom))
         # Let's find the left edge
         blackcount = 0
@@ -337,35 +293,40 @@ class LeagueOfAngels:
     def click(self, x, y, xorient=Orient.Left, yorient=Orient.Top):
         x, y = self.game_to_client(x, y, xorient, yorient)
         logging.debug('Clicking {},{}'.format(x, y))
+        if self.capture.recorder is not None:
+            self.capture.recorder.event('click', x=x, y=y)
+        desktop = get_desktop()
         if self.mode == Mode.Window:
-            position = makelong(x, y)
-            win32gui.PostMessage(self.hwnd, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, position)
-            time.sleep(0.01)
-            win32gui.PostMessage(self.hwnd, win32con.WM_LBUTTONUP, win32con.MK_LBUTTON, position)
+            desktop.post_click(self.hwnd, x, y)
         else:
-            oldx, oldy = win32api.GetCursorPos()
-            win32api.SetCursorPos((x, y))
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0)
-            win32api.SetCursorPos((oldx, oldy))
+            oldx, oldy = desktop.cursor_position()
+            desktop.set_cursor_position(x, y)
+            desktop.click()
+            desktop.set_cursor_position(oldx, oldy)
 
     def mouse_move(self, x, y, xorient=Orient.Left, yorient=Orient.Top):
         x, y = self.game_to_client(x, y, xorient, yorient)
         logging.debug('Moving mouse to {},{}'.format(x, y))
+        if self.capture.recorder is not None:
+            self.capture.recorder.event('move', x=x, y=y)
         if self.mode == Mode.Window:
-            position = makelong(x, y)
-            win32gui.PostMessage(self.hwnd, win32con.WM_MOUSEMOVE, 0, position)
+            get_desktop().post_move(self.hwnd, x, y)
         else:
-            win32api.SetCursorPos((x, y))
+            get_desktop().set_cursor_position(x, y)
 
     def mouse_get(self, xorient=Orient.Left, yorient=Orient.Top):
-        x, y = win32gui.GetCursorPos()
+        x, y = get_desktop().cursor_position()
         x, y = self.client_to_game(x, y, xorient, yorient)
         logging.debug('Mouse at game pos {}({}),{}({})'.format(x, xorient, y, yorient))
         return x, y
 
-    arrow_cursor = win32api.LoadCursor(0, win32con.IDC_ARROW)
-    hand_cursor = win32api.LoadCursor(0, win32con.IDC_HAND)
+    @property
+    def arrow_cursor(self):
+        return get_desktop().arrow_cursor
+
+    @property
+    def hand_cursor(self):
+        return get_desktop().hand_cursor
 
     def check_cursor(self, x, y, cursor, xorient=Orient.Left, yorient=Orient.Top):
         if self.mode != Mode.Desktop:
@@ -377,8 +338,7 @@ class LeagueOfAngels:
         time.sleep(0.010)
         self.mouse_move(x, y)
         time.sleep(0.010)
-        flags, current_cursor, position = win32gui.GetCursorInfo()
-        return current_cursor == cursor
+        return get_desktop().cursor() == cursor
 
     def image_find(self, image, x, y, xorient=Orient.Left, yorient=Orient.Top, screenshot=None,
                    radius=2, threshold=None, great_threshold=None):
@@ -387,7 +347,7 @@ class LeagueOfAngels:
         """
         searchpos = self.game_to_client(x, y, xorient, yorient)
         if screenshot is None:
-            screenshot = self.capture_screenshot()
+            screenshot = self.capture.grab(search_box(image.size, searchpos[0], searchpos[1], radius))
         pos = image_search(screenshot, image, *searchpos, radius=radius,
                            threshold=threshold, great_threshold=great_threshold)
 
@@ -400,9 +360,26 @@ class LeagueOfAngels:
             offsety = 0
         return FoundPosition(pos[0], pos[1], offsetx, offsety)
 
+    def image_find_all(self, image, region=None, screenshot=None, threshold=None):
+        """
+        Finds all occurrences of an image in the game.
+        :param region: Rect in game coordinates to limit the search to, defaults to the whole game.
+        :return: List of (x, y, rms) tuples in game coordinates, best match first.
+        """
+        if screenshot is None:
+            screenshot = self.capture.grab(self.gamepos)
+        if region is None:
+            region = Rect(0, 0, self.gamepos.right - self.gamepos.left, self.gamepos.bottom - self.gamepos.top)
+        if threshold is None:
+            threshold = image.size[0] * image.size[1] * 10.0
+        left, top = self.game_to_client(region.left, region.top)
+        right, bottom = self.game_to_client(region.right, region.bottom)
+        matches = matching.find_image(screenshot.crop((left, top, right, bottom)), image, threshold)
+        return [(x + region.left, y + region.top, rms) for x, y, rms in matches]
+
     def find_back_button(self):
         if not "Back" in self.resources:
-            self.resources['Back'] = Image.open(script_dir + '/misc/Back.png')
+            self.resources['Back'] = load_template('misc/Back.png')
         # Arena
         back_pos = self.image_find(self.resources['Back'], 73, 65, Orient.Right, Orient.Bottom)
         # Domination
@@ -441,7 +418,7 @@ if __name__ == "__main__":
         game.capture_screenshot().crop(game.gamepos).save("screenshot_{}.png".format(
             datetime.datetime.now().strftime("%Y%m%d-%H%M%S")))
     if args.mouse:
-        x, y = win32api.GetCursorPos()
+        x, y = get_desktop().cursor_position()
         leftx, topy = game.client_to_game(x, y, Orient.Left, Orient.Top)
         centerx, centery = game.client_to_game(x, y, Orient.Center, Orient.Center)
         rightx, bottomy = game.client_to_game(x, y, Orient.Right, Orient.Bottom)
@@ -6,6 +6,7 @@ from utility.logconfig import *
 import argparse
 import os.path
 from loa import *
+from utility.templates import load_template
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -14,6 +15,9 @@ parser = argparse.ArgumentParser(description='Click Ready whenever it appears.',
 parser.add_argument('--debug', action='store_true', help="""
 Enable debug mode, extra details will be added to log file.
 """)
+parser.add_argument('--capture-thread', action='store_true', help="""
+Grab the game continuously on a background thread, so searches don't wait on grabbing the screen.
+""")
 args = parser.parse_args()
 
 loglevel = VERBOSE
@@ -23,8 +27,10 @@ logconfig('ready', loglevel)
 
 
 game = LeagueOfAngels()
+if args.capture_thread:
+    game.start_capture_thread()
 
-ready_button = Image.open(script_dir + '/misc/Ready.png')
+ready_button = load_template('misc/Ready.png')
 
 
 while True:
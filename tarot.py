@@ -7,7 +7,10 @@ import os.path
 from utility.mouse import *
 from utility.screen import *
 from utility.logconfig import *
-from PIL import ImageGrab, Image
+from utility.templates import load_template, load_templates
+from utility.capture import Capture, search_box
+from utility.recorder import Recorder
+from PIL import Image
 import logging
 import functools
 import math
@@ -117,33 +120,25 @@ class TarotCards:
         self.freeflips = 0
         self.extraflips = 0
         self.freeflipsonly = False
+        self.capture = Capture()
 
         logging.info("Loading cards...")
         self.tarot_cards = []
-        scriptdir = os.path.dirname(os.path.realpath(__file__))
-        globstring = os.path.join(scriptdir, "tarot/cards/*.png")
-        for file in glob.glob(globstring):
-            name = os.path.basename(file)
-            name, ext = os.path.splitext(name)
-            # Limit compared card size to 30x20
-            self.tarot_cards.append((name, Image.open(file)))
+        for name, card in load_templates("tarot/cards/*.png"):
+            self.tarot_cards.append((name, card))
             logging.debug("Loaded card: {0}".format(name))
 
         logging.info("Loading digits...")
         self.digits = []
-        scriptdir = os.path.dirname(os.path.realpath(__file__))
-        globstring = os.path.join(scriptdir, "tarot/digits/*.png")
-        for file in glob.glob(globstring):
-            name = os.path.basename(file)
-            name, ext = os.path.splitext(name)
-            self.digits.append((name, Image.open(file)))
+        for name, digit in load_templates("tarot/digits/*.png"):
+            self.digits.append((name, digit))
             logging.log(VERBOSE, "Loaded digit: {0}".format(name))
 
         self.card_corners = {
-            1: Image.open("tarot/back1.png"),
-            3: Image.open("tarot/back3.png"),
-            5: Image.open("tarot/back5.png"),
-            8: Image.open("tarot/back8.png")
+            1: load_template("tarot/back1.png"),
+            3: load_template("tarot/back3.png"),
+            5: load_template("tarot/back5.png"),
+            8: load_template("tarot/back8.png")
         }
 
     def compare_cards(self):
@@ -165,14 +160,20 @@ class TarotCards:
                 region_count, (region[2] - region[0]) * (region[3] - region[1]), worst_matchup, worst_rms))
         sys.exit(0)
 
+    def record(self, filename):
+        """
+        Record the game window as it is grabbed, and clicks, see utility.recorder. Call after orient.
+        """
+        self.capture.recorder = Recorder(filename, self.gamepos)
+        Mouse.recorder = self.capture.recorder
+
     def find_next(self):
         # Search for next button.
         logging.log(VERBOSE, "Searching for next button...")
-        next_image = Image.open("tarot/next.png")
+        next_image = load_template("tarot/next.png")
         searchx = self.gamecenter[0] - 45
         searchy = self.gamecenter[1] + 65
-        best_x, best_y = image_search(ImageGrab.grab(), next_image, searchx, searchy)
-        next_image.close()
+        best_x, best_y = image_search(self.capture.grab(), next_image, searchx, searchy)
         return best_x, best_y
 
     def orient(self):
@@ -193,11 +194,10 @@ class TarotCards:
                            self.gamepos[1] + int(self.gamesize[1] / 2))
         # Search for start button to center.
         logging.log(VERBOSE, "Searching for start button...")
-        start_image = Image.open("tarot/start.png")
+        start_image = load_template("tarot/start.png")
         searchx = self.gamecenter[0] - 31
         searchy = self.gamecenter[1] + 97
-        best_x, best_y = image_search(ImageGrab.grab(), start_image, searchx, searchy)
-        start_image.close()
+        best_x, best_y = image_search(self.capture.grab(), start_image, searchx, searchy)
 
         if best_x != -1:
             self.gamecenter = (best_x + 31, best_y - 96)
@@ -219,7 +219,7 @@ class TarotCards:
         # Let's calibrate this with the first card which is never really covered.
         card_corner = self.get_image_back_corner()
         # Adjust center
-        screengrab = ImageGrab.grab()
+        screengrab = self.capture.grab()
         logging.log(VERBOSE, "Calibrating via card 0, card back")
         searchx, searchy = card_positions[self.level][0]
         searchx += self.gamecenter[0] - 6
@@ -258,14 +258,18 @@ class TarotCards:
     def parse_flips(self):
         logging.log(VERBOSE, "Parsing flips...")
         value = 0
+        # Grab the area of every digit at every search offset once, each digit and offset is a crop of it.
+        left = flips_offsetx + self.gamepos[0]
+        top = flips_offsety + self.gamepos[1]
+        self.capture.tick()
+        frame = self.capture.latest((left - 2, top - 2, left + 2 + 3 * digit_width - 1, top + 2 + digit_height - 1))
         for x in range(3):
-            for posx, posy in search_offset(offsetx=flips_offsetx + self.gamepos[0],
-                                            offsety=flips_offsety + self.gamepos[1]):
+            for posx, posy in search_offset(offsetx=left, offsety=top):
                 digit_pos = (posx + (x * digit_width),
                              posy,
                              posx + (x * digit_width) + digit_width - 1,
                              posy + digit_height - 1)
-                digit_image = ImageGrab.grab(digit_pos)
+                digit_image = frame.crop(digit_pos)
                 digit_value = self.match_digit(digit_image)
                 if digit_value is not None:
                     logging.log(VERBOSE, "Digit found, offset from expected: {0},{1}".format(
@@ -289,7 +293,7 @@ class TarotCards:
     def parse_level(self):
         logging.log(VERBOSE, "Parsing level...")
         value = -1
-        screengrab = ImageGrab.grab()
+        screengrab = self.capture.grab()
         for x in range(2):
             digit_value, digit_posx, digit_posy = detect_image(
                 screengrab, self.digits, level_offsetx + self.gamepos[0] + (x * digit_width),
@@ -314,23 +318,22 @@ class TarotCards:
         cardpos = (self.gamecenter[0] + card_positions[self.level][cardnum][0] + int(card_width / 2),
                    self.gamecenter[1] + card_positions[self.level][cardnum][1] + 15)
         logging.log(VERBOSE, "Flipping level {0} card {1} at position {2}".format(self.level, cardnum, cardpos))
+        card_box = self.card_box(cardnum)
         timeout = time.time() + fliptimeout
         card_back = True
         while time.time() < timeout:
+            reference = self.capture.grab(card_box)
             Mouse.click(*cardpos)
-            clicktimeout_time = time.time() + clicktimeout
-            # Wait for card back to go away.
-            while time.time() < clicktimeout_time and card_back:
+            # Wait for the card to start flipping, then to finish, before checking the back is gone.
+            if self.capture.wait_for_change(card_box, clicktimeout, reference) is not None:
+                self.capture.wait_for_stable(card_box, clicktimeout)
                 card_back = self.detect_card_back(cardnum)[0] != -1
-                time.sleep(0.010)
-            if not card_back:
-                break
+                if not card_back:
+                    break
             logging.warning("Card click does not appear to have registered, clicking again.")
         if card_back:
             logging.error("Timed out waiting for card to flip over.")
             return False
-        # Sleep a bit to wait for the card to flip.
-        time.sleep(0.200)
         self.flips_left -= 1
         self.freeflips -= 1
         if self.freeflips < 0:
@@ -344,7 +347,7 @@ class TarotCards:
                 return True
             else:
                 logging.error("Failed to detect card {0} level {1}".format(cardnum, self.level))
-                ImageGrab.grab().save("failed_detection.png")
+                self.capture.grab().save("failed_detection.png")
                 logging.info("Screenshot saved to failed_detection.png")
                 return False
         return True
@@ -362,14 +365,22 @@ class TarotCards:
 
     def detect_card_back(self, cardnum, radius=3):
         card_corner = self.get_image_back_corner()
-        # Search for card back.
-        screengrab = ImageGrab.grab()
+        # Search for card back, only grabbing the area searched.
         searchx, searchy = card_positions[self.level][cardnum]
         searchx += self.gamecenter[0] - 6
         searchy += self.gamecenter[1] - 6
+        screengrab = self.capture.grab(search_box(card_corner.size, searchx, searchy, radius))
         newx, newy = image_search(screengrab, card_corner, searchx, searchy, radius=radius)
         return newx, newy
 
+    def card_box(self, cardnum):
+        """
+        :return: Bounding box of the screen detect_card looks at.
+        """
+        searchx = self.gamecenter[0] + card_positions[self.level][cardnum][0]
+        searchy = self.gamecenter[1] + card_positions[self.level][cardnum][1]
+        return search_box(self.tarot_cards[0][1].size, searchx, searchy, 1)
+
     def detect_card(self, cardnum, dumb=False, timeout=3.0):
         logging.log(VERBOSE, "Attempting to detect card {0}".format(cardnum))
         timeout_time = time.time() + timeout
@@ -377,7 +388,8 @@ class TarotCards:
             logging.log(VERBOSE, "Checking against cards...")
             searchx = self.gamecenter[0] + card_positions[self.level][cardnum][0]
             searchy = self.gamecenter[1] + card_positions[self.level][cardnum][1]
-            card_name, x, y = detect_image(ImageGrab.grab(), self.tarot_cards,
+            screengrab = self.capture.grab(self.card_box(cardnum))
+            card_name, x, y = detect_image(screengrab, self.tarot_cards,
                                            searchx, searchy,
                                            radius=1, threshold=2000.0, compare_regions=card_match_regions)
             if card_name is not None:
@@ -386,9 +398,9 @@ class TarotCards:
                 self.cards_on_board[cardnum].name = card_name
                 return True
             elif not dumb and self.learn:
-                # Wait a little longer for the card flip to definitely complete.
-                time.sleep(0.050)
-                card_image = ImageGrab.grab((searchx, searchy, searchx + 70, searchy + 123))
+                # Make sure the card flip has definitely completed.
+                self.capture.wait_for_stable(self.card_box(cardnum), 0.5)
+                card_image = self.capture.grab((searchx, searchy, searchx + 70, searchy + 123)).image
                 self.learncount += 1
                 card_name = "Unknown{0}".format(self.learncount)
                 card_image.save("tarot/cards/{0}.png".format(card_name))
@@ -434,7 +446,7 @@ class TarotCards:
                 time.sleep(1.0)
             card_corner = self.get_image_back_corner()
             # Adjust card positions.
-            screengrab = ImageGrab.grab()
+            screengrab = self.capture.grab()
             timeout = time.time() + 6.0
             for i in range(len(card_positions[self.level])):
                 logging.log(VERBOSE, "Calibrating card {0:>2}".format(i + 1))
@@ -447,7 +459,7 @@ class TarotCards:
                         break
                     if newx == -1:
                         # Update our screengrab.
-                        screengrab = ImageGrab.grab()
+                        screengrab = self.capture.grab()
 
                 if newx == -1:
                     logging.warning("Failed to calibrate card position {0}".format(i + 1))
@@ -638,6 +650,9 @@ if __name__ == '__main__':
     parser.add_argument('--debug', action='store_true', help="""
     Send debug output to console. It is always sent to log file, so this is rarely recommended.
     """)
+    parser.add_argument('--record', metavar='FILE', help="""
+    Record what is seen of the game, and clicks, to FILE so a session can be replayed.
+    """)
     args = parser.parse_args()
 
 
@@ -655,6 +670,8 @@ if __name__ == '__main__':
     #sys.exit(0)
 
     tarot.orient()
+    if args.record:
+        tarot.record(args.record)
 
     if args.guessflips:
         tarot.parse_flips()
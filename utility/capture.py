@@ -0,0 +1,380 @@
+__author__ = 'Jody Shumaker'
+
+import collections
+import glob
+import logging
+import os.path
+import threading
+import time
+import numpy as np
+from PIL import ImageGrab, Image
+from utility.desktop import get_desktop
+from utility.recorder import read_recording
+
+
+def search_box(size, searchx, searchy, radius):
+    """
+    :param size: (width, height) of the image searched for.
+    :return: Bounding box of the screen an image search around searchx, searchy within radius looks at.
+    """
+    return (searchx - radius, searchy - radius, searchx + size[0] + radius, searchy + size[1] + radius)
+
+
+def signature(image, step=4):
+    """
+    :param step: Pixels averaged together in each direction.
+    :return: Downsampled grayscale of an image as an array, cheap to compare frames with.
+    """
+    image = image.convert('L')
+    size = (max(1, image.size[0] // step), max(1, image.size[1] // step))
+    return np.asarray(image.resize(size, Image.BOX), dtype=np.int16)
+
+
+def difference(signature1, signature2):
+    """
+    :return: Mean absolute difference of two signatures in gray levels, 0.0 if identical.
+    """
+    if signature1.shape != signature2.shape:
+        return float('inf')
+    return float(np.abs(signature1 - signature2).mean())
+
+
+class Backend:
+    """
+    Source of images of the screen for Capture.
+    """
+
+    def grab(self, box=None):
+        """
+        :param box: Bounding box in screen coordinates, None for the whole screen.
+        :return: PIL image of the box, or None if the grab failed.
+        """
+        raise Exception("grab must be overridden.")
+
+    def screen_size(self):
+        """
+        :return: (width, height) of the whole screen.
+        """
+        return self.grab().size
+
+
+class ImageGrabBackend(Backend):
+    """
+    Grabs the desktop.
+    """
+
+    def grab(self, box=None):
+        if box is None:
+            return ImageGrab.grab()
+        return ImageGrab.grab(box)
+
+
+class PrintWindowBackend(Backend):
+    """
+    Grabs a window even when it's covered by others, coordinates are relative to the window.
+    """
+
+    def __init__(self, hwnd):
+        self.hwnd = hwnd
+
+    def grab(self, box=None):
+        im = get_desktop().grab_window(self.hwnd)
+        if im is not None and box is not None:
+            im = im.crop(box)
+        return im
+
+
+class ReplayBackend(Backend):
+    """
+    Plays back recorded images of the screen instead of grabbing it. Each grab returns the next image, the last image
+    repeats once the end is reached unless looping.
+    """
+
+    def __init__(self, frames, loop=False):
+        """
+        :param frames: List of PIL images or paths to image files.
+        """
+        self.frames = list(frames)
+        if not self.frames:
+            raise ValueError("No frames to replay.")
+        self.loop = loop
+        self.index = 0
+        self.loaded = None
+
+    @classmethod
+    def from_files(cls, pattern, loop=False):
+        """
+        :param pattern: Directory of PNG files or a glob pattern, images are played in filename order.
+        """
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.png')
+        return cls(sorted(glob.glob(pattern)), loop)
+
+    @classmethod
+    def from_recording(cls, filename, loop=False):
+        """
+        :param filename: Recording written by utility.recorder.Recorder, the recorded region becomes the whole screen.
+        """
+        return cls([image for timestamp, kind, image in read_recording(filename) if kind == 'frame'], loop)
+
+    @classmethod
+    def from_path(cls, path, loop=False):
+        """
+        :param path: Recording, or directory of PNG files or glob pattern, see from_recording and from_files.
+        """
+        if os.path.isfile(path):
+            return cls.from_recording(path, loop)
+        return cls.from_files(path, loop)
+
+    def image(self, index):
+        frame = self.frames[index]
+        if not isinstance(frame, str):
+            return frame
+        # Only keep the current file loaded, sequences can be long.
+        if self.loaded is None or self.loaded[0] != index:
+            image = Image.open(frame)
+            image.load()
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            self.loaded = (index, image)
+        return self.loaded[1]
+
+    def grab(self, box=None):
+        image = self.image(self.index)
+        if self.index + 1 < len(self.frames):
+            self.index += 1
+        elif self.loop:
+            self.index = 0
+        if box is not None:
+            image = image.crop(box)
+        return image
+
+    def screen_size(self):
+        return self.image(self.index).size
+
+
+class Frame:
+    """
+    A grab of a region of the screen. Takes screen coordinates, so a frame can be searched in place of a full
+    screengrab for anything within its region.
+    """
+
+    def __init__(self, image, left=0, top=0, timestamp=None, fullscreen=False):
+        self.image = image
+        self.left = left
+        self.top = top
+        # time.time() of when the frame was grabbed.
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.fullscreen = fullscreen
+
+    @property
+    def box(self):
+        return self.left, self.top, self.left + self.image.size[0], self.top + self.image.size[1]
+
+    def age(self):
+        """
+        :return: Seconds since the frame was grabbed.
+        """
+        return time.time() - self.timestamp
+
+    def contains(self, box):
+        """
+        :param box: Bounding box in screen coordinates, None for the whole screen.
+        """
+        if box is None:
+            return self.fullscreen
+        left, top, right, bottom = self.box
+        return left <= box[0] and top <= box[1] and box[2] <= right and box[3] <= bottom
+
+    def crop(self, box):
+        """
+        Crop a region by screen coordinates, areas outside the frame are black.
+        """
+        return self.image.crop((box[0] - self.left, box[1] - self.top, box[2] - self.left, box[3] - self.top))
+
+    def getpixel(self, xy):
+        return self.image.getpixel((xy[0] - self.left, xy[1] - self.top))
+
+    def save(self, filename):
+        self.image.save(filename)
+
+
+class Capture:
+    """
+    Grabs frames of the screen. Grabs are limited to the region needed, and lookups within a tick share one frame.
+
+    Optionally a background thread grabs a region continuously, see start_thread. Grabs within that region then take
+    the newest buffered frame, so searching one frame overlaps grabbing the next.
+    """
+
+    def __init__(self, region=None, backend=None):
+        """
+        :param region: Bounding box grabbed by default, such as the game window. None for the whole screen.
+        :param backend: Backend to grab from, defaults to grabbing the desktop.
+        """
+        self.region = region
+        self.backend = ImageGrabBackend() if backend is None else backend
+        self.frame = None
+        self.grabs = 0
+        # utility.recorder.Recorder that every frame grabbed is sent to.
+        self.recorder = None
+        # Background grabbing, see start_thread.
+        self.thread = None
+        self.running = False
+        self.buffer = None
+        self.condition = threading.Condition()
+        # Timestamp of the newest buffered frame handed out, grab waits for a newer one.
+        self.served = 0.0
+
+    def start_thread(self, region=None, buffer_size=4, interval=0.0):
+        """
+        Grab a region continuously on a background thread, keeping the newest frames.
+        :param region: Bounding box to grab, such as the game window. None for the whole screen.
+        :param buffer_size: Frames kept, older frames are dropped.
+        :param interval: Seconds to sleep between grabs, 0 to grab as fast as the backend allows.
+        """
+        self.stop_thread()
+        if region is not None:
+            region = tuple(int(value) for value in region)
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.running = True
+        self.thread = threading.Thread(target=self.run_thread, args=(region, interval), name='Capture', daemon=True)
+        self.thread.start()
+
+    def stop_thread(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
+        self.buffer = None
+
+    def run_thread(self, region, interval):
+        while self.running:
+            timestamp = time.time()
+            image = self.backend.grab(region)
+            if image is not None:
+                if region is None:
+                    frame = Frame(image, timestamp=timestamp, fullscreen=True)
+                else:
+                    frame = Frame(image, region[0], region[1], timestamp)
+                with self.condition:
+                    self.buffer.append(frame)
+                    self.condition.notify_all()
+            if interval > 0:
+                time.sleep(interval)
+
+    def buffered(self, box, since=None, timeout=1.0):
+        """
+        :param since: time.time() the frame must have been grabbed after, defaults to after the last frame served.
+        :return: Newest buffered frame, cropped to box, or None if the thread has no suitable frame.
+        """
+        newer = self.served if since is None else max(self.served, since)
+        with self.condition:
+            if self.buffer and not self.buffer[-1].contains(box):
+                return None
+            if not self.condition.wait_for(lambda: self.buffer and self.buffer[-1].timestamp > newer, timeout):
+                return None
+            frame = self.buffer[-1]
+        if not frame.contains(box):
+            return None
+        self.served = frame.timestamp
+        if box is not None and box != frame.box:
+            frame = Frame(frame.crop(box), box[0], box[1], frame.timestamp)
+        return frame
+
+    def grab(self, box=None, since=None):
+        """
+        Grab a new frame, which is kept for the rest of the tick.
+        :param box: Bounding box in screen coordinates, defaults to the capture region.
+        :param since: With the background thread, time.time() the frame must have been grabbed after, such as the
+        time of a click. Grabbing directly always starts after it.
+        :return: Frame, or None if the backend failed to grab.
+        """
+        if box is None:
+            box = self.region
+        if box is not None:
+            box = tuple(int(value) for value in box)
+        frame = None
+        if self.thread is not None:
+            frame = self.buffered(box, since)
+        if frame is not None:
+            self.frame = frame
+        else:
+            timestamp = time.time()
+            image = self.backend.grab(box)
+            if image is None:
+                self.frame = None
+            elif box is None:
+                self.frame = Frame(image, timestamp=timestamp, fullscreen=True)
+            else:
+                self.frame = Frame(image, box[0], box[1], timestamp)
+        self.grabs += 1
+        if self.recorder is not None and self.frame is not None:
+            self.recorder.frame(self.frame)
+        return self.frame
+
+    def latest(self, box=None):
+        """
+        :param box: Bounding box needed, defaults to the capture region.
+        :return: The frame of this tick if it covers box, otherwise a new frame.
+        """
+        if box is None:
+            box = self.region
+        if self.frame is not None and self.frame.contains(box):
+            return self.frame
+        return self.grab(box)
+
+    def wait_for_change(self, box=None, timeout=1.0, reference=None, threshold=1.0, interval=0.010):
+        """
+        Wait until a region of the screen changes, such as an animation starting.
+        :param box: Bounding box to watch, defaults to the capture region.
+        :param reference: Frame to compare against, defaults to grabbing the region now.
+        :param threshold: Mean gray level difference that counts as a change, see difference.
+        :return: First frame that changed, or None if it timed out.
+        """
+        timeout_time = time.time() + timeout
+        if reference is None:
+            reference = self.grab(box)
+            if reference is None:
+                return None
+        before = signature(reference.image)
+        while time.time() < timeout_time:
+            time.sleep(interval)
+            frame = self.grab(box)
+            if frame is not None and difference(before, signature(frame.image)) > threshold:
+                return frame
+        return None
+
+    def wait_for_stable(self, box=None, timeout=1.0, settle=0.060, threshold=1.0, interval=0.010):
+        """
+        Wait until a region of the screen stops changing, such as an animation finishing.
+        :param box: Bounding box to watch, defaults to the capture region.
+        :param settle: Seconds the region must stay the same, longer than a frame of the game's animations.
+        :param threshold: Mean gray level difference below which frames count as the same, see difference.
+        :return: Frame once stable, or None if it timed out.
+        """
+        timeout_time = time.time() + timeout
+        frame = self.grab(box)
+        if frame is None:
+            return None
+        stable_since = frame.timestamp
+        before = signature(frame.image)
+        while time.time() < timeout_time:
+            time.sleep(interval)
+            frame = self.grab(box)
+            if frame is None:
+                continue
+            after = signature(frame.image)
+            if difference(before, after) > threshold:
+                stable_since = frame.timestamp
+                before = after
+            elif frame.timestamp - stable_since >= settle:
+                return frame
+        return None
+
+    def tick(self):
+        """
+        Start a new tick, the next lookup grabs a new frame.
+        """
+        self.frame = None
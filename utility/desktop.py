@@ -0,0 +1,231 @@
+__author__ = 'Jody Shumaker'
+
+import logging
+import time
+from PIL import Image
+
+# Only created when first used, see get_desktop.
+_desktop = None
+
+
+def get_desktop():
+    """
+    :return: The Desktop, created on first use. Modules that only simulate or match images never create it, so they
+    import and start worker processes without any platform libraries.
+    """
+    global _desktop
+    if _desktop is None:
+        try:
+            _desktop = Win32Desktop()
+        except ImportError as e:
+            raise Exception("Controlling the game needs Windows and pywin32: {0}".format(e))
+    return _desktop
+
+
+def set_desktop(desktop):
+    """
+    Use a different Desktop, such as one for another platform.
+    """
+    global _desktop
+    _desktop = desktop
+
+
+def makelong(low, high):
+    return low | (high << 16)
+
+
+class Desktop:
+    """
+    Windows and the mouse of the platform the game runs on. Screen coordinates throughout.
+    """
+    # Handles of the arrow and hand cursors, to compare against cursor.
+    arrow_cursor = None
+    hand_cursor = None
+
+    def cursor_position(self):
+        """
+        :return: x, y tuple of the mouse, or None if it couldn't be read.
+        """
+        raise Exception("cursor_position must be overridden.")
+
+    def set_cursor_position(self, x, y):
+        raise Exception("set_cursor_position must be overridden.")
+
+    def click(self):
+        """
+        Left click wherever the mouse is.
+        """
+        raise Exception("click must be overridden.")
+
+    def cursor(self):
+        """
+        :return: Handle of the cursor currently shown.
+        """
+        raise Exception("cursor must be overridden.")
+
+    def find_windows(self, title):
+        """
+        :return: List of (hwnd, window text) tuples of visible windows with title in their text.
+        """
+        raise Exception("find_windows must be overridden.")
+
+    def focus_window(self, hwnd, force=False):
+        """
+        Bring a window to the front and restore it if minimized.
+        :param force: Work around the platform refusing to give focus to a window of another program.
+        """
+        raise Exception("focus_window must be overridden.")
+
+    def window_rect(self, hwnd):
+        """
+        :return: (left, top, right, bottom) of a window including its borders.
+        """
+        raise Exception("window_rect must be overridden.")
+
+    def client_rect(self, hwnd):
+        """
+        :return: (left, top, right, bottom) of the inside of a window, relative to the window.
+        """
+        raise Exception("client_rect must be overridden.")
+
+    def client_to_screen(self, hwnd, x, y):
+        """
+        :return: x, y tuple of a position relative to the inside of a window in screen coordinates.
+        """
+        raise Exception("client_to_screen must be overridden.")
+
+    def post_click(self, hwnd, x, y):
+        """
+        Send a left click to a window without moving the mouse.
+        :param x: x relative to the inside of the window.
+        """
+        raise Exception("post_click must be overridden.")
+
+    def post_move(self, hwnd, x, y):
+        """
+        Send a mouse move to a window without moving the mouse.
+        """
+        raise Exception("post_move must be overridden.")
+
+    def grab_window(self, hwnd):
+        """
+        :return: PIL image of the inside of a window even if it's covered by others, or None if the grab failed.
+        """
+        raise Exception("grab_window must be overridden.")
+
+
+class Win32Desktop(Desktop):
+    """
+    Desktop of Windows through pywin32.
+    """
+
+    def __init__(self):
+        import win32api
+        import win32con
+        import win32gui
+        self.win32api = win32api
+        self.win32con = win32con
+        self.win32gui = win32gui
+        self.arrow_cursor = win32api.LoadCursor(0, win32con.IDC_ARROW)
+        self.hand_cursor = win32api.LoadCursor(0, win32con.IDC_HAND)
+
+    def cursor_position(self):
+        from ctypes import windll, wintypes, byref
+        point = wintypes.POINT()
+        if windll.user32.GetCursorPos(byref(point)):
+            return point.x, point.y
+        return None
+
+    def set_cursor_position(self, x, y):
+        self.win32api.SetCursorPos((x, y))
+
+    def click(self):
+        self.win32api.mouse_event(self.win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
+        self.win32api.mouse_event(self.win32con.MOUSEEVENTF_LEFTUP, 0, 0)
+
+    def cursor(self):
+        flags, current_cursor, position = self.win32gui.GetCursorInfo()
+        return current_cursor
+
+    def find_windows(self, title):
+        windows = []
+
+        def foreach_window(hwnd, lparam):
+            if self.win32gui.IsWindowVisible(hwnd):
+                window_text = self.win32gui.GetWindowText(hwnd)
+                if title in window_text:
+                    windows.append((hwnd, window_text))
+                    logging.debug("Found window hwnd: {0} title: {1}".format(hwnd, window_text))
+            return True
+
+        self.win32gui.EnumWindows(foreach_window, None)
+        return windows
+
+    def focus_window(self, hwnd, force=False):
+        if force:
+            # Ugly hack to let us set foreground window. COM is slow to load, only import it when needed.
+            import win32com.client
+            shell = win32com.client.Dispatch("WScript.Shell")
+            shell.SendKeys('%')
+        self.win32gui.SetWindowPos(hwnd, self.win32con.HWND_TOP, 0, 0, 0, 0,
+                                   self.win32con.SWP_NOMOVE + self.win32con.SWP_NOSIZE +
+                                   self.win32con.SWP_SHOWWINDOW)
+        self.win32gui.SetForegroundWindow(hwnd)
+        self.win32gui.ShowWindow(hwnd, self.win32con.SW_RESTORE)
+
+    def window_rect(self, hwnd):
+        return self.win32gui.GetWindowRect(hwnd)
+
+    def client_rect(self, hwnd):
+        return self.win32gui.GetClientRect(hwnd)
+
+    def client_to_screen(self, hwnd, x, y):
+        return self.win32gui.ClientToScreen(hwnd, (x, y))
+
+    def post_click(self, hwnd, x, y):
+        position = makelong(x, y)
+        self.win32gui.PostMessage(hwnd, self.win32con.WM_LBUTTONDOWN, self.win32con.MK_LBUTTON, position)
+        time.sleep(0.01)
+        self.win32gui.PostMessage(hwnd, self.win32con.WM_LBUTTONUP, self.win32con.MK_LBUTTON, position)
+
+    def post_move(self, hwnd, x, y):
+        self.win32gui.PostMessage(hwnd, self.win32con.WM_MOUSEMOVE, 0, makelong(x, y))
+
+    def grab_window(self, hwnd):
+        import win32ui
+        from ctypes import windll
+
+        im = None
+        left, top, right, bot = self.win32gui.GetClientRect(hwnd)
+        w = right - left
+        h = bot - top
+
+        hwnddc = self.win32gui.GetWindowDC(hwnd)
+        mfcdc = win32ui.CreateDCFromHandle(hwnddc)
+        savedc = mfcdc.CreateCompatibleDC()
+
+        savebitmap = win32ui.CreateBitmap()
+        savebitmap.CreateCompatibleBitmap(mfcdc, w, h)
+
+        savedc.SelectObject(savebitmap)
+
+        # Change the line below depending on whether you want the whole window
+        # or just the client area.
+        result = windll.user32.PrintWindow(hwnd, savedc.GetSafeHdc(), 1)
+        logging.debug("PrintWindow result: {}".format(result))
+
+        if result == 1:
+            bmpinfo = savebitmap.GetInfo()
+            logging.debug(bmpinfo)
+            bmpstr = savebitmap.GetBitmapBits(True)
+
+            im = Image.frombuffer(
+                'RGB',
+                (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
+                bmpstr, 'raw', 'BGRX', 0, 1)
+
+        self.win32gui.DeleteObject(savebitmap.GetHandle())
+        savedc.DeleteDC()
+        mfcdc.DeleteDC()
+        self.win32gui.ReleaseDC(hwnd, hwnddc)
+        return im
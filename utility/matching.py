@@ -0,0 +1,256 @@
+__author__ = 'Jody Shumaker'
+
+import numpy as np
+
+
+def image_pixels(image):
+    """
+    Convert an image to an array of RGB values.
+    :param image: PIL image, any alpha channel is dropped.
+    :return: float64 array of shape (height, width, 3)
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image, dtype=np.float64)
+
+
+def image_weights(image):
+    """
+    Get the alpha channel of an image to weight pixel comparisons by.
+    :param image: PIL image
+    :return: float64 array of shape (height, width), or None if the image has no alpha channel.
+    """
+    if 'A' not in image.getbands():
+        return None
+    return np.asarray(image.getchannel('A'), dtype=np.float64)
+
+
+class Template:
+    """
+    An image to search for, converted once to the arrays used by the matchers.
+    """
+
+    def __init__(self, image, name=None):
+        self.image = image
+        self.name = name
+        self.size = image.size
+        self.pixels = image_pixels(image)
+        self.weights = image_weights(image)
+        # Weights as a fraction, and the weighted sum of each color. Used to bound scores when searching.
+        self.scale = None if self.weights is None else self.weights / 255
+        if self.scale is None:
+            self.pixel_sum = self.pixels.sum(axis=(0, 1))
+        else:
+            self.pixel_sum = (self.pixels * self.scale[:, :, None]).sum(axis=(0, 1))
+        self.regions = {}
+
+    def crop(self, box):
+        """
+        :return: Template of a region of this image, kept so the region is only cropped and converted once.
+        """
+        box = tuple(box)
+        region = self.regions.get(box)
+        if region is None:
+            region = Template(self.image.crop(box), self.name)
+            self.regions[box] = region
+        return region
+
+
+def as_template(image):
+    """
+    :return: The image as a Template, converting it if it's a PIL image.
+    """
+    if isinstance(image, Template):
+        return image
+    return Template(image)
+
+
+def template_arrays(image):
+    """
+    Convert an image we search for into the arrays used by the matchers.
+    :return: (pixels, weights) tuple, see image_pixels and image_weights.
+    """
+    if isinstance(image, Template):
+        return image.pixels, image.weights
+    return image_pixels(image), image_weights(image)
+
+
+def pixel_distances(pixels1, pixels2):
+    """
+    Distance between the RGB values of each pixel.
+    :return: Array of distances with the last axis of the inputs removed.
+    """
+    diff = pixels1 - pixels2
+    return np.sqrt((diff * diff).sum(axis=-1))
+
+
+def weighted_sum(distances, weights):
+    """
+    Total the pixel distances of one or more comparisons.
+    :param distances: Array whose last two axes are (height, width).
+    :param weights: Alpha weights of the compared image or None.
+    :return: Array of totals with the last two axes removed.
+    """
+    if weights is not None:
+        # Scale by the alpha channel, this ignores fully transparent pixels, and can give less weight to partially
+        # transparent pixels.
+        distances = distances * weights / 255
+    if distances.shape[-1] * distances.shape[-2] == 0:
+        return np.zeros(distances.shape[:-2])
+    # Accumulate column by column, same as walking every pixel, so scores are identical to the old per pixel loop.
+    columns = np.swapaxes(distances, -1, -2).reshape(distances.shape[:-2] + (-1,))
+    return np.cumsum(columns, axis=-1)[..., -1]
+
+
+def compare_arrays(pixels1, pixels2, weights2=None):
+    """
+    Compare arrays produced by image_pixels and image_weights.
+    :return: Sum of the distance of every pixel, scaled by the weight of the second image.
+    """
+    return float(weighted_sum(pixel_distances(pixels1, pixels2), weights2))
+
+
+def compare_images(i1, i2):
+    """
+    Compare two images of the same size.
+    :param i1: Image being checked, typically a crop of a screengrab.
+    :param i2: Image to compare against, if it has an alpha channel pixels are weighted by it.
+    :return: Sum of the distance of every pixel, 0.0 is a perfect match.
+    """
+    if i1.size != i2.size:
+        raise ValueError("Image sizes for comparison do not match. {0} vs {1}".format(i1.size, i2.size))
+    pixels2, weights2 = template_arrays(i2)
+    return compare_arrays(template_arrays(i1)[0], pixels2, weights2)
+
+
+def crop_pixels(screengrab, box):
+    """
+    Crop a region of a screengrab to an RGB array, areas outside the screengrab are black.
+    """
+    return image_pixels(screengrab.crop(box))
+
+
+def offset_scores(screengrab, image, left, top, xradius, yradius):
+    """
+    Compare an image against every position within a radius of left, top in a single pass.
+    :param screengrab: Image to search.
+    :param image: Image to search for.
+    :param left: x coordinate of the center of the search.
+    :param top: y coordinate of the center of the search.
+    :param xradius: max +/- x offset to score.
+    :param yradius: max +/- y offset to score.
+    :return: Array of scores indexed by [yoffset + yradius, xoffset + xradius], same values as compare_images.
+    """
+    pixels, weights = template_arrays(image)
+    height, width = pixels.shape[:2]
+    patch = crop_pixels(screengrab, (left - xradius, top - yradius,
+                                     left + xradius + width, top + yradius + height))
+    # View of every window within the patch, shape (rows, columns, height, width, 3)
+    windows = np.lib.stride_tricks.sliding_window_view(patch, (height, width, 3))[:, :, 0]
+    scores = np.empty((yradius * 2 + 1, xradius * 2 + 1))
+    # Score a row of offsets at a time to keep the temporary arrays small for large searches.
+    for row in range(scores.shape[0]):
+        scores[row] = weighted_sum(pixel_distances(windows[row], pixels), weights)
+    return scores
+
+
+def search_extent(offsets):
+    """
+    :param offsets: list of x, y offsets relative to 0, 0
+    :return: (xradius, yradius) covering all the offsets.
+    """
+    return max(abs(x) for x, y in offsets), max(abs(y) for x, y in offsets)
+
+
+def fft_size(n):
+    """
+    :return: Smallest size >= n with only 2, 3 and 5 as factors, which the FFT handles quickly.
+    """
+    best = 1
+    while best < n:
+        best *= 2
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            size = power35
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def window_sums(pixels, weights, height, width):
+    """
+    Weighted sum of the RGB values under every window position.
+    :param pixels: Array from image_pixels of the image being searched.
+    :param weights: Weights of the window, or None for an unweighted window.
+    :return: Array of shape (rows, columns, 3).
+    """
+    rows = pixels.shape[0] - height + 1
+    columns = pixels.shape[1] - width + 1
+    if weights is None:
+        # Integral image, any window sum is then 4 lookups.
+        integral = np.zeros((pixels.shape[0] + 1, pixels.shape[1] + 1, 3))
+        integral[1:, 1:] = pixels.cumsum(axis=0).cumsum(axis=1)
+        return (integral[height:, width:] - integral[:rows, width:] -
+                integral[height:, :columns] + integral[:rows, :columns])
+    # Weighted windows need a cross correlation, do it via FFT.
+    shape = (fft_size(pixels.shape[0] + height - 1), fft_size(pixels.shape[1] + width - 1))
+    kernel = np.fft.rfft2(weights[::-1, ::-1], shape)
+    transformed = np.fft.rfft2(pixels, shape, axes=(0, 1)) * kernel[:, :, None]
+    correlation = np.fft.irfft2(transformed, shape, axes=(0, 1))
+    return correlation[height - 1:height - 1 + rows, width - 1:width - 1 + columns]
+
+
+def find_image(screengrab, image, threshold, min_distance=None):
+    """
+    Find all occurrences of an image within a screengrab.
+
+    Every position gets a cheap lower bound of its score, the distance between the weighted sum of the window and
+    of the image. Only positions whose bound is under the threshold are scored exactly.
+    :param screengrab: Image to search.
+    :param image: Image to search for.
+    :param threshold: Maximum score to be considered a match.
+    :param min_distance: (x, y) distance a match must be from a better match to be kept. Defaults to the image size,
+    so overlapping matches are suppressed.
+    :return: List of (x, y, rms) tuples of the top left of each match, best match first.
+    """
+    template = as_template(image)
+    pixels, weights = template.pixels, template.weights
+    height, width = pixels.shape[:2]
+    screen = image_pixels(screengrab)
+    if screen.shape[0] < height or screen.shape[1] < width:
+        return []
+    if min_distance is None:
+        min_distance = (width, height)
+
+    difference = window_sums(screen, template.scale, height, width) - template.pixel_sum
+    bounds = np.sqrt((difference * difference).sum(axis=-1))
+    # Allow a little slack for floating point error in the FFT.
+    candidates_y, candidates_x = np.nonzero(bounds < threshold + 1.0)
+
+    windows = np.lib.stride_tricks.sliding_window_view(screen, (height, width, 3))[:, :, 0]
+    matches = []
+    # Score candidates in chunks to keep the temporary arrays small.
+    chunk = max(1, 65536 // (height * width))
+    for start in range(0, len(candidates_y), chunk):
+        ys = candidates_y[start:start + chunk]
+        xs = candidates_x[start:start + chunk]
+        scores = weighted_sum(pixel_distances(windows[ys, xs], pixels), weights)
+        for x, y, rms in zip(xs, ys, scores):
+            if rms < threshold:
+                matches.append((int(x), int(y), float(rms)))
+
+    # Non-maximum suppression, keep the best match of any overlapping group.
+    matches.sort(key=lambda match: match[2])
+    kept = []
+    for x, y, rms in matches:
+        for keptx, kepty, keptrms in kept:
+            if abs(x - keptx) < min_distance[0] and abs(y - kepty) < min_distance[1]:
+                break
+        else:
+            kept.append((x, y, rms))
+    return kept
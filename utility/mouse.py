@@ -1,44 +1,32 @@
 __author__ = 'Jody Shumaker'
 
-from ctypes import *
-import win32con
-import win32gui
-import win32api
 import time
 import logging
-
-
-# noinspection PyPep8Naming
-class _point_t(Structure):
-    _fields_ = [
-        ('x',  c_long),
-        ('y',  c_long),
-    ]
+from utility.desktop import get_desktop
 
 
 class Mouse:
+    # utility.recorder.Recorder that clicks and moves are sent to.
+    recorder = None
+
     @staticmethod
     def get_position():
-        point = _point_t()
-        result = windll.user32.GetCursorPos(pointer(point))
-        if result:
-            return point.x, point.y
-        else:
-            return None
+        return get_desktop().cursor_position()
 
     @staticmethod
     def move(x, y):
-        win32api.SetCursorPos((x, y))
+        if Mouse.recorder is not None:
+            Mouse.recorder.event('move', x=x, y=y)
+        get_desktop().set_cursor_position(x, y)
 
     @staticmethod
     def click(x, y):
         logging.debug("Clicking: {0},{1}".format(x, y))
-        win32api.SetCursorPos((x, y))
-        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
-        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0)
-
-    arrow_cursor = win32api.LoadCursor(0, win32con.IDC_ARROW)
-    hand_cursor = win32api.LoadCursor(0, win32con.IDC_HAND)
+        if Mouse.recorder is not None:
+            Mouse.recorder.event('click', x=x, y=y)
+        desktop = get_desktop()
+        desktop.set_cursor_position(x, y)
+        desktop.click()
 
     @staticmethod
     def get_cursor(position=None):
@@ -48,8 +36,7 @@ class Mouse:
             time.sleep(0.010)
             Mouse.move(*position)
             time.sleep(0.010)
-        flags, current_cursor, position = win32gui.GetCursorInfo()
-        return current_cursor
+        return get_desktop().cursor()
 
     @staticmethod
     def cursor_is_hand(position=None):
@@ -59,8 +46,8 @@ class Mouse:
             time.sleep(0.010)
             Mouse.move(*position)
             time.sleep(0.010)
-        flags, current_cursor, position = win32gui.GetCursorInfo()
-        return current_cursor == Mouse.hand_cursor
+        desktop = get_desktop()
+        return desktop.cursor() == desktop.hand_cursor
 
     @staticmethod
     def cursor_is_arrow(position=None):
@@ -70,5 +57,5 @@ class Mouse:
             time.sleep(0.010)
             Mouse.move(*position)
             time.sleep(0.010)
-        flags, current_cursor, position = win32gui.GetCursorInfo()
-        return current_cursor == Mouse.arrow_cursor
\ No newline at end of file
+        desktop = get_desktop()
+        return desktop.cursor() == desktop.arrow_cursor
\ No newline at end of file
@@ -0,0 +1,175 @@
+__author__ = 'Jody Shumaker'
+
+import atexit
+import json
+import logging
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from PIL import Image
+
+# A recording is an append only file, the header followed by records of:
+#   kind (1 byte), timestamp (double), payload length (4 bytes), payload.
+# A keyframe payload is the width and height then the zlib compressed RGB bytes of the region. A patch payload is the
+# left, top, width and height of the box grabbed within the region, then the zlib compressed XOR of the box against what
+# was there before, mostly zeros as little of the screen changes between grabs. An event payload is JSON, such as a
+# click. Older recordings have delta records instead of patches, the XOR of the whole region.
+HEADER = b'LOAREC1\n'
+RECORD = struct.Struct('<BdI')
+SIZE = struct.Struct('<HH')
+BOX = struct.Struct('<HHHH')
+KEYFRAME = 1
+DELTA = 2
+EVENT = 3
+PATCH = 4
+
+
+class Recorder:
+    """
+    Records frames grabbed by a Capture, and input events, to a file. Frames are pasted into an image of the region,
+    so the recording shows the region as the bot last saw each part of it. Compression and writing happen on a
+    background thread, recording only costs the grab a queue put.
+    """
+
+    def __init__(self, filename, region, keyframe_interval=100, queue_size=100):
+        """
+        :param filename: File to append the recording to.
+        :param region: Bounding box of the screen to record, such as the game window.
+        :param keyframe_interval: Frames between keyframes, a damaged recording can be read from the next keyframe.
+        :param queue_size: Frames and events waiting to be written before further frames are dropped. Events are never
+        dropped, so the clicks recorded always match what was done.
+        """
+        self.filename = filename
+        self.region = tuple(int(value) for value in region)
+        self.keyframe_interval = keyframe_interval
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER)
+        self.canvas = np.zeros((self.region[3] - self.region[1], self.region[2] - self.region[0], 3), np.uint8)
+        # Frames since the last keyframe, None until the first is written.
+        self.since_keyframe = None
+        self.frames = 0
+        self.dropped = 0
+        self.queue_size = queue_size
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='Recorder', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        logging.info("Recording to {0}".format(filename))
+
+    def frame(self, frame):
+        """
+        Queue a frame to be recorded.
+        :param frame: utility.capture.Frame
+        """
+        if self.queue.qsize() >= self.queue_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait((frame.timestamp, frame))
+
+    def event(self, name, timestamp=None, **data):
+        """
+        Queue an input event, such as event('click', x=x, y=y) with screen coordinates.
+        """
+        data['event'] = name
+        self.queue.put_nowait((time.time() if timestamp is None else timestamp, data))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            timestamp, value = item
+            if isinstance(value, dict):
+                self.write(EVENT, timestamp, json.dumps(value, sort_keys=True).encode('utf-8'))
+            else:
+                self.write_frame(timestamp, value)
+
+    def write_frame(self, timestamp, frame):
+        height, width = self.canvas.shape[:2]
+        # Box of the frame within the region, grabs can reach past its edges.
+        left = frame.left - self.region[0]
+        top = frame.top - self.region[1]
+        x1, y1 = max(left, 0), max(top, 0)
+        x2, y2 = min(left + frame.image.size[0], width), min(top + frame.image.size[1], height)
+        if x2 <= x1 or y2 <= y1:
+            return
+        patch = np.asarray(frame.image.convert('RGB'))[y1 - top:y2 - top, x1 - left:x2 - left]
+        if self.since_keyframe is None or self.since_keyframe >= self.keyframe_interval:
+            self.canvas[y1:y2, x1:x2] = patch
+            self.write(KEYFRAME, timestamp, SIZE.pack(width, height) + zlib.compress(self.canvas.tobytes(), 1))
+            self.since_keyframe = 0
+        else:
+            delta = np.bitwise_xor(self.canvas[y1:y2, x1:x2], patch)
+            self.canvas[y1:y2, x1:x2] = patch
+            self.write(PATCH, timestamp, BOX.pack(x1, y1, x2 - x1, y2 - y1) + zlib.compress(delta.tobytes(), 1))
+            self.since_keyframe += 1
+        self.frames += 1
+
+    def write(self, kind, timestamp, payload):
+        self.file.write(RECORD.pack(kind, timestamp, len(payload)))
+        self.file.write(payload)
+
+    def close(self):
+        """
+        Write any queued frames and close the file.
+        """
+        if self.file.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        logging.info("Recorded {0} frames to {1}, dropped {2}".format(self.frames, self.filename, self.dropped))
+
+
+def read_recording(filename):
+    """
+    Read a recording written by Recorder.
+    :return: Generator of (timestamp, 'frame', PIL image) and (timestamp, 'event', dict) tuples. Frames that did not
+    change reuse the previous image.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(HEADER)) != HEADER:
+            raise ValueError("{0} is not a recording.".format(filename))
+        pixels = None
+        image = None
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            kind, timestamp, length = RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                # Recording was cut off while being written.
+                break
+            if kind == EVENT:
+                yield timestamp, 'event', json.loads(payload.decode('utf-8'))
+                continue
+            if kind == KEYFRAME:
+                width, height = SIZE.unpack(payload[:SIZE.size])
+                pixels = np.frombuffer(zlib.decompress(payload[SIZE.size:]), np.uint8).reshape((height, width, 3))
+                pixels = pixels.copy()
+            elif kind in (DELTA, PATCH):
+                if pixels is None:
+                    # Can't apply a delta until the first keyframe.
+                    continue
+                if kind == PATCH:
+                    left, top, width, height = BOX.unpack(payload[:BOX.size])
+                    payload = payload[BOX.size:]
+                else:
+                    left, top = 0, 0
+                    height, width = pixels.shape[:2]
+                delta = np.frombuffer(zlib.decompress(payload), np.uint8).reshape((height, width, 3))
+                if delta.any():
+                    pixels[top:top + height, left:left + width] ^= delta
+                elif image is not None:
+                    yield timestamp, 'frame', image
+                    continue
+            else:
+                continue
+            # Copied, the pixels change in place with the next delta.
+            image = Image.frombytes('RGB', (pixels.shape[1], pixels.shape[0]), pixels.tobytes())
+            yield timestamp, 'frame', image
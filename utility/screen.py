@@ -3,13 +3,11 @@ __author__ = 'Jody Shumaker'
 import math
 import sys
 import logging
-import win32gui
-import win32con
-import win32ui
-import win32com.client
-from ctypes import *
 from PIL import ImageGrab, Image
 import time
+from utility import matching
+from utility.desktop import get_desktop
+from utility.matching import compare_images, offset_scores, search_extent
 
 class Color:
     def __init__(self, r, g, b, a=0):
@@ -57,42 +55,9 @@ def get_avg_pixel(image, x, y, r=15):
     return avgpixel
 
 
-def compare_images(i1, i2):
-    rms = 0.0
-    if i1.size != i2.size:
-        raise ValueError("Image sizes for comparison do not match. {0} vs {1}".format(i1.size, i2.size))
-    width, height = i1.size
-    for x in range(width):
-        for y in range(height):
-            pixel2 = i2.getpixel((x, y))
-            # Skip if fully transparent.
-            if len(pixel2) > 3 and pixel2[3] == 0:
-                continue
-            pixel1 = i1.getpixel((x, y))
-
-            pixel_rms = math.sqrt((pixel1[0] - pixel2[0])**2 + (pixel1[1] - pixel2[1])**2 + (pixel1[2] - pixel2[2])**2)
-            if len(pixel2) > 3:
-                # Second image has an alpha channel, let's scale our rms value by the alpha channel.
-                # This ignores fully transparent pixels, and can give less weight to partially transparent pixels.
-                rms += pixel_rms * pixel2[3] / 255
-            else:
-                rms += pixel_rms
-    return rms
-
-
 def get_game_window(auto=False):
-    windows = []
-
-    def foreach_window(hwnd, lParam):
-        nonlocal windows
-        if win32gui.IsWindowVisible(hwnd):
-            window_text = win32gui.GetWindowText(hwnd)
-            if "League of Angels" in window_text:
-                windows.append((hwnd, window_text))
-                logging.debug("Found game window hwnd: {0} title: {1}".format(hwnd, window_text))
-        return True
-
-    win32gui.EnumWindows(foreach_window, None)
+    desktop = get_desktop()
+    windows = desktop.find_windows("League of Angels")
     if len(windows) == 0:
         logging.error("Failed to find game window.")
         sys.exit(1)
@@ -110,19 +75,12 @@ def get_game_window(auto=False):
     else:
         game_hwnd = windows[0][0]
 
-    # Ugly hack to let us set foreground window.
-    shell = win32com.client.Dispatch("WScript.Shell")
-    shell.SendKeys('%')
-
     # Make this window active.
-    win32gui.SetWindowPos(game_hwnd, win32con.HWND_TOP, 0, 0, 0, 0,
-                          win32con.SWP_NOMOVE + win32con.SWP_NOSIZE + win32con.SWP_SHOWWINDOW)
-    win32gui.SetForegroundWindow(game_hwnd)
-    win32gui.ShowWindow(game_hwnd, win32con.SW_RESTORE)
+    desktop.focus_window(game_hwnd, force=True)
     time.sleep(0.050)
 
-    windowleft, windowtop, windowright, windowbottom = win32gui.GetWindowRect(game_hwnd)
-    clientleft, clienttop, clientright, clientbottom = win32gui.GetClientRect(game_hwnd)
+    windowleft, windowtop, windowright, windowbottom = desktop.window_rect(game_hwnd)
+    clientleft, clienttop, clientright, clientbottom = desktop.client_rect(game_hwnd)
     logging.debug("Window position: {},{},{},{}".format(windowleft, windowtop, windowright, windowbottom))
 
     if windowleft < 0:
@@ -132,7 +90,7 @@ def get_game_window(auto=False):
 
     top = -1
     left = -1
-    right, bottom = win32gui.ClientToScreen(game_hwnd, (clientright, clientbottom))
+    right, bottom = desktop.client_to_screen(game_hwnd, clientright, clientbottom)
 
     screengrab = ImageGrab.grab()
     # Let's find the left edge
@@ -232,10 +190,14 @@ def image_search(screengrab, image, searchx, searchy, threshold=None, radius=5,
         # use an automatic value based upon size.
         great_threshold = image_width * image_height * 3
 
+    # Score every offset at once, the spiral then only decides which match is taken.
+    scores = offset_scores(screengrab, image, searchx, searchy, radius, radius)
     best_x = -1
     best_y = -1
-    for x, y in search_offset(radius=radius, offsetx=searchx, offsety=searchy):
-        rms = compare_images(screengrab.crop((x, y, x + image_width, y + image_height)), image)
+    for x, y in search_offset(radius=radius):
+        rms = scores[y + radius, x + radius]
+        x += searchx
+        y += searchy
         logging.debug("Image Search {0},{1}  rms: {2:>10.3f}".format(x, y, rms))
         if best_rms is None or rms < best_rms:
             best_y = y
@@ -272,16 +234,22 @@ def detect_image(screengrab, imageset, searchx, searchy, threshold=None, radius=
 
     if compare_regions is None:
         compare_regions = [(0, 0, image_width, image_height)]
+    offsets = list(search_offset(radius=radius, xradius=xradius, yradius=yradius, algorithm=algorithm))
+    search_xradius, search_yradius = search_extent(offsets)
     best_x = -1
     best_y = -1
     best_name = None
     for region in compare_regions:
-        for x, y in search_offset(radius=radius, offsetx=searchx, offsety=searchy,
-                                  xradius=xradius, yradius=yradius, algorithm=algorithm):
-            for name, image in imageset:
-                image_region = image.crop(region)
-                screengrab_region = screengrab.crop((x + region[0], y + region[1], x + region[2], y + region[3]))
-                rms = compare_images(screengrab_region, image_region)
+        # Score every offset for each image at once, then walk the offsets in search order.
+        scores = []
+        for name, image in imageset:
+            scores.append(offset_scores(screengrab, image.crop(region), searchx + region[0], searchy + region[1],
+                                        search_xradius, search_yradius))
+        for offsetx, offsety in offsets:
+            x = searchx + offsetx
+            y = searchy + offsety
+            for (name, image), image_scores in zip(imageset, scores):
+                rms = image_scores[offsety + search_yradius, offsetx + search_xradius]
                 logging.debug("Image Search {0},{1}  rms: {2:>10.3f} name: {3}".format(x, y, rms, name))
                 if best_rms is None or rms < best_rms:
                     best_y = y
@@ -297,24 +265,19 @@ def detect_image(screengrab, imageset, searchx, searchy, threshold=None, radius=
     return best_name, best_x, best_y
 
 
-def find_image(screengrab, image, threshold=None):
+def find_image(screengrab, image, threshold=None, min_distance=None):
     """
     Find all occurences of image within screengrab.
     :param screengrab:
     :param image:
     :param threshold: Maximum rms to be considered a match. Defaults to None which causes an automatic value to be
     calculated of image width * height.
+    :param min_distance: (x, y) distance within which only the best match is kept, defaults to the image size.
     :return:
-    List of tuples of matches.
+    List of (x, y, rms) tuples of matches, best match first.
     """
-    matches = []
-    image_width, image_height = image.size
-    screen_width, screen_height = screengrab.size
     if threshold is None:
         # Use an automatic threshold.
+        image_width, image_height = image.size
         threshold = image_width * image_height * 10.0
-    for x in range(screen_width - image_width):
-        for y in range(screen_height - image_height):
-            if compare_images(screengrab.crop((x, y, x + image_width, y + image_height)), image) < threshold:
-                matches.append((x, y))
-    return matches
\ No newline at end of file
+    return matching.find_image(screengrab, image, threshold, min_distance=min_distance)
@@ -0,0 +1,49 @@
+__author__ = 'Jody Shumaker'
+
+
+def mean(values):
+    return float(sum(values)) / len(values) if values else 0.0
+
+
+def confidence_interval(values, z=1.96):
+    """
+    :param z: Standard score of the confidence level, defaults to 95%.
+    :return: (mean, margin) tuple, the mean is within +/- margin at the confidence level.
+    """
+    if len(values) < 2:
+        return mean(values), 0.0
+    average = mean(values)
+    variance = sum((value - average) ** 2 for value in values) / (len(values) - 1)
+    return average, z * (variance / len(values)) ** 0.5
+
+
+def ratio_confidence_interval(numerators, denominators, z=1.96):
+    """
+    Confidence interval of sum(numerators) / sum(denominators), such as total points over total energy, by the
+    linearized ratio estimator.
+    :param z: Standard score of the confidence level, defaults to 95%.
+    :return: (ratio, margin) tuple, the ratio is within +/- margin at the confidence level.
+    """
+    total = float(sum(denominators))
+    if total == 0:
+        return 0.0, 0.0
+    ratio = sum(numerators) / total
+    count = len(denominators)
+    if count < 2:
+        return ratio, 0.0
+    residuals = [numerator - ratio * denominator for numerator, denominator in zip(numerators, denominators)]
+    variance = sum(residual ** 2 for residual in residuals) / (count - 1)
+    return ratio, z * (variance * count) ** 0.5 / total
+
+
+def percentile(values, percent):
+    """
+    :param percent: 0 to 100
+    :return: The value at a percentile of values, the sorted value at (len(values) - 1) * percent / 100 rounded to the
+    closest index. 0.0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
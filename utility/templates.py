@@ -0,0 +1,53 @@
+__author__ = 'Jody Shumaker'
+
+import glob
+import logging
+import os.path
+from PIL import Image
+from utility.matching import Template
+
+script_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Loaded templates by absolute path.
+_templates = {}
+
+
+def load_template(path):
+    """
+    Load an image to search for. Each file is only loaded and converted once, later calls return the same Template.
+    :param path: Path to the image, relative paths are relative to the script directory.
+    """
+    path = os.path.normpath(os.path.join(script_dir, path))
+    template = _templates.get(path)
+    if template is None:
+        name, ext = os.path.splitext(os.path.basename(path))
+        image = Image.open(path)
+        image.load()
+        template = Template(image, name)
+        _templates[path] = template
+        logging.debug("Loaded template: {0}".format(path))
+    return template
+
+
+def load_templates(pattern):
+    """
+    Load every image matching a glob pattern.
+    :param pattern: Glob pattern, relative to the script directory, e.g. "grid/digits/*.png"
+    :return: List of (name, template) tuples sorted by name, name being the filename without extension.
+    """
+    templates = []
+    for file in sorted(glob.glob(os.path.join(script_dir, pattern))):
+        template = load_template(file)
+        templates.append((template.name, template))
+    return templates
+
+
+def draw_template(image, template, x, y):
+    """
+    Draw a template onto an image with its top left at x, y, blending by its alpha channel if it has one.
+    """
+    source = template.image
+    if 'A' in source.getbands():
+        image.paste(source.convert('RGB'), (x, y), source.getchannel('A'))
+    else:
+        image.paste(source.convert('RGB'), (x, y))
@@ -6,6 +6,7 @@ from utility.logconfig import *
 import argparse
 import os.path
 from loa import *
+from utility.templates import load_template
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -13,6 +14,12 @@ parser = argparse.ArgumentParser(description='Automatically join world boss.', f
 parser.add_argument('--debug', action='store_true', help="""
 Enable debug mode, extra details will be added to log file.
 """)
+parser.add_argument('--capture-thread', action='store_true', help="""
+Grab the game continuously on a background thread, so searches don't wait on grabbing the screen.
+""")
+parser.add_argument('--record', metavar='FILE', help="""
+Record what is seen of the game, and clicks, to FILE so a session can be replayed.
+""")
 args = parser.parse_args()
 
 loglevel = VERBOSE
@@ -21,52 +28,38 @@ if args.debug:
 logconfig('worldboss', loglevel)
 
 # Resources.
-icon_corner_image = Image.open(os.path.join(script_dir, "misc/IconCorner.png"))
-daily_tasks_image = Image.open(os.path.join(script_dir, "misc/DailyTasks.png"))
-join_image = Image.open(os.path.join(script_dir, "misc/Join.png"))
-morale_image = Image.open(os.path.join(script_dir, "misc/Morale.png"))
-morale_inactive_image = Image.open(os.path.join(script_dir, "misc/MoraleInactive.png"))
+daily_tasks_image = load_template("misc/DailyTasks.png")
+join_image = load_template("misc/Join.png")
+morale_image = load_template("misc/Morale.png")
+morale_inactive_image = load_template("misc/MoraleInactive.png")
 
 
 game = LeagueOfAngels()
+if args.capture_thread:
+    game.start_capture_thread()
+if args.record:
+    game.record(args.record)
 
 
 # Return to the home screen.
 game.goto_homepage()
 
 screenshot = game.capture_screenshot()
-calibrated = False
+# Icons are laid out right to left, 62 pixels apart, in rows 70 pixels apart.
 xreset = game.gamepos.right - 237 - game.gamepos.left
-yreset = 8
+icons_per_row = max(1, int((xreset - 310) / 62) + 1)
+icon_rows = int((40 + icons_per_row - 1) / icons_per_row)
+icon_area = Rect(300, 0, xreset + 60, 8 + icon_rows * 70 + 10)
 
 # Find the daily tasks button.
 logging.log(VERBOSE, "Searching for daily tasks button.")
 found = False
 for i in range(12):
-    x, y = xreset, yreset
-    icon_count = 0
-    while not found and icon_count < 40:
-        if not calibrated:
-            icon_corner = game.image_find(icon_corner_image, x, y, screenshot=screenshot,
-                                          radius=8, great_threshold=1000.0)
-            if icon_corner.x != 1:
-                x += icon_corner.xoffset
-                xreset += icon_corner.xoffset
-                y += icon_corner.yoffset
-                yreset += icon_corner.yoffset
-                calibrated = True
-                logging.log(VERBOSE, "Icon corner found, offset from expected: {0},{1}".format(
-                    icon_corner.xoffset, icon_corner.yoffset))
-        if game.image_find(daily_tasks_image, x, y, radius=0, threshold=120000, screenshot=screenshot)[0] != -1:
-            logging.log(VERBOSE, "Daily tasks button found, {0},{1}".format(x, y))
-            found = True
-        else:
-            x -= 62
-            if x < 310:
-                x = xreset
-                y += 70
-        icon_count += 1
-    if found:
+    matches = game.image_find_all(daily_tasks_image, region=icon_area, threshold=120000, screenshot=screenshot)
+    if len(matches) > 0:
+        x, y, rms = matches[0]
+        logging.log(VERBOSE, "Daily tasks button found, {0},{1} rms: {2:0.1f}".format(x, y, rms))
+        found = True
         break
     else:
         time.sleep(10)